@@ -0,0 +1,223 @@
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from pathway_connections import PathwayConnection, PathwayConnectionSet
+from entity_factories import SignorEntityFactory
+from pathway_importer import pathway_connection_filter_protein_binding, model_from_connections
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', "--sizes", type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                    help="Row counts of the synthetic pathways to benchmark. Defaults to 100 1000 10000 100000")
+parser.add_argument("--seed", type=int, default=0,
+                    help="Random seed for the synthetic pathways, so runs are comparable. Defaults to 0")
+parser.add_argument("--repeat", type=int, default=1,
+                    help="Times to run each size, keeping the fastest time of each phase. Defaults to 1")
+parser.add_argument("--duplicate_fraction", type=float, default=0.1,
+                    help="Fraction of rows repeating an earlier statement with another reference. Defaults to 0.1")
+parser.add_argument("--keep", type=str,
+                    help="Directory to keep the generated pathway TSVs in instead of a temporary one")
+parser.add_argument("--json", type=str,
+                    help="Also write the timings to this JSON file")
+parser.add_argument("--verbose", action="store_true",
+                    help="Show the converter's own output instead of hiding it")
+
+PHASES = ["parse_file", "filter", "generate_model", "write"]
+HEADER = ["PATHWAY_ID", "PATHWAY_NAME", "ENTITYA", "REGULATOR_LOCATION", "TYPEA", "IDA", "DATABASEA", "ENTITYB",
+          "TARGET_LOCATION", "TYPEB", "IDB", "DATABASEB", "EFFECT", "MECHANISM", "RESIDUE", "SEQUENCE", "TAX_ID",
+          "CELL_DATA", "TISSUE_DATA", "MODULATOR_COMPLEX", "TARGET_COMPLEX", "MODIFICATIONA", "MODASEQ",
+          "MODIFICATIONB", "MODBSEQ", "PMID", "DIRECT", "NOTES", "ANNOTATOR", "SENTENCE", "SIGNOR_ID"]
+
+
+class SyntheticSignorPathway:
+    # Seeded generator of SIGNOR pathway TSV rows shaped like the real downloads: mostly proteins with some
+    # complexes (from the loaded SIGNOR complex data), small molecules and miRNAs, mechanisms from the mechanism
+    # mapping, a few rows the converter skips (phenotypes, protein families, "form complex") and repeated
+    # statements. The entity pool grows with the row count so the graph stays about as sparse as a real pathway.
+    ENTITY_TYPE_WEIGHTS = {"protein": 80, "complex": 7, "smallmolecule": 8, "mirna": 3, "phenotype": 1,
+                           "proteinfamily": 1}
+    EFFECT_WEIGHTS = {"up-regulates": 15, "up-regulates activity": 30, "up-regulates quantity": 3,
+                      "up-regulates quantity by expression": 5, "up-regulates quantity by stabilization": 1,
+                      "down-regulates": 10, "down-regulates activity": 20, "down-regulates quantity": 2,
+                      "down-regulates quantity by destabilization": 3, "down-regulates quantity by repression": 2,
+                      "unknown": 3, "form complex": 1}
+    SMALL_MOLECULE_MECHANISMS = ["chemical activation", "chemical inhibition", "binding"]
+    ANNOTATORS = ["lperfetto", "miannu", "gcesareni", "fspada", "apalma"]
+
+    def __init__(self, seed=0, duplicate_fraction=0.1, complex_ids=None):
+        self.seed = seed
+        self.duplicate_fraction = duplicate_fraction
+        if complex_ids is None:
+            complex_ids = sorted(SignorEntityFactory.complex_factory().complexes)
+        self.complex_ids = complex_ids
+        self.entity_types = {t: w for t, w in self.ENTITY_TYPE_WEIGHTS.items() if t != "complex" or complex_ids}
+        mechanisms = PathwayConnection.MECHANISM_GO_MAPPING.acceptable_mechanisms()
+        self.mechanisms = sorted(m for m in mechanisms if m and m not in ["small molecule catalysis"] +
+                                 self.SMALL_MOLECULE_MECHANISMS)
+
+    def entity(self, rng, pool_size):
+        entity_type = rng.choices(list(self.entity_types), weights=list(self.entity_types.values()))[0]
+        n = rng.randrange(pool_size)
+        if entity_type == "complex" and n < len(self.complex_ids):
+            # Only as many complexes as there are in the reference data, each no more common than any other entity
+            complex_id = self.complex_ids[n]
+            return entity_type, complex_id, complex_id, "SIGNOR"
+        if entity_type in ["protein", "complex"]:
+            return "protein", f"PROT{n}", f"P{n:05d}", "UNIPROT"
+        if entity_type == "smallmolecule":
+            return entity_type, f"CHEM{n}", f"CHEBI:{10000 + n}", "ChEBI"
+        if entity_type == "mirna":
+            return entity_type, f"miR-{n}", f"MIMAT{n:07d}", "miRBase"
+        if entity_type == "phenotype":
+            return entity_type, f"PHENOTYPE_{n}", f"SIGNOR-PH{n}", "SIGNOR"
+        return entity_type, f"FAMILY{n}", f"SIGNOR-PF{n}", "SIGNOR"
+
+    def mechanism(self, rng, type_a, type_b):
+        if type_b == "smallmolecule":
+            return "small molecule catalysis"
+        if type_a == "smallmolecule":
+            return rng.choice(self.SMALL_MOLECULE_MECHANISMS)
+        return rng.choice(self.mechanisms)
+
+    def rows(self, row_count, pathway_id="SIGNOR-SYNTH"):
+        # Same seed and row_count always gives the same rows
+        rng = random.Random(f"{self.seed}-{row_count}")
+        pool_size = max(20, row_count // 4)
+        effects = list(self.EFFECT_WEIGHTS)
+        effect_weights = list(self.EFFECT_WEIGHTS.values())
+        rows = []
+        for i in range(row_count):
+            if rows and rng.random() < self.duplicate_fraction:
+                # Same statement again, most of the time from another paper
+                row = dict(rng.choice(rows))
+                if rng.random() < 0.8:
+                    row["PMID"] = str(rng.randrange(10000000, 40000000))
+                row["SIGNOR_ID"] = f"SIGNOR-{i}"
+                rows.append(row)
+                continue
+            type_a, name_a, id_a, db_a = self.entity(rng, pool_size)
+            type_b, name_b, id_b, db_b = self.entity(rng, pool_size)
+            row = dict.fromkeys(HEADER, "")
+            row.update({
+                "PATHWAY_ID": pathway_id, "PATHWAY_NAME": "Synthetic benchmark pathway",
+                "ENTITYA": name_a, "TYPEA": type_a, "IDA": id_a, "DATABASEA": db_a,
+                "ENTITYB": name_b, "TYPEB": type_b, "IDB": id_b, "DATABASEB": db_b,
+                "EFFECT": rng.choices(effects, weights=effect_weights)[0],
+                "MECHANISM": self.mechanism(rng, type_a, type_b),
+                "TAX_ID": "9606", "PMID": str(rng.randrange(10000000, 40000000)),
+                "DIRECT": rng.choice(["t", "t", "f"]), "ANNOTATOR": rng.choice(self.ANNOTATORS),
+                "SIGNOR_ID": f"SIGNOR-{i}"
+            })
+            rows.append(row)
+        return rows
+
+    def write(self, filename, row_count):
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=HEADER, delimiter="\t", lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(self.rows(row_count))
+        return filename
+
+
+def time_phases(filename, outfile, verbose=False):
+    # Seconds spent in each phase of converting one pathway file, plus how many connections/triples came out
+    SignorEntityFactory.registry.clear()
+    timings = {}
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        start = time.perf_counter()
+        p_connections = PathwayConnectionSet.parse_file(filename)
+        timings["parse_file"] = time.perf_counter() - start
+        parsed = len(p_connections)
+
+        start = time.perf_counter()
+        p_connections = pathway_connection_filter_protein_binding(p_connections)
+        timings["filter"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model = model_from_connections(p_connections, "SIGNOR - Synthetic benchmark pathway")
+        timings["generate_model"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model.write(outfile)
+        timings["write"] = time.perf_counter() - start
+    return {"connections": parsed, "filtered_connections": len(p_connections),
+            "triples": len(model.writer.writer.graph), "seconds": timings}
+
+
+def scaling_exponents(results):
+    # Slope of log(time) against log(rows) between consecutive sizes: ~1 is linear, ~2 quadratic
+    exponents = []
+    for previous, current in zip(results, results[1:]):
+        slopes = {}
+        for phase in PHASES:
+            t0, t1 = previous["seconds"][phase], current["seconds"][phase]
+            if t0 > 0 and t1 > 0:
+                slopes[phase] = math.log(t1 / t0) / math.log(current["rows"] / previous["rows"])
+        exponents.append({"from_rows": previous["rows"], "to_rows": current["rows"], "exponents": slopes})
+    return exponents
+
+
+def run_benchmark(sizes, seed=0, repeat=1, duplicate_fraction=0.1, workdir=None, verbose=False):
+    pathway_generator = SyntheticSignorPathway(seed=seed, duplicate_fraction=duplicate_fraction)
+    results = []
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(workdir, exist_ok=True)
+        for rows in sorted(sizes):
+            filename = pathway_generator.write(os.path.join(workdir, f"SIGNOR-SYNTH-{rows}-{seed}.tsv"), rows)
+            outfile = os.path.join(workdir, f"SIGNOR-SYNTH-{rows}-{seed}.ttl")
+            best = None
+            for _ in range(repeat):
+                run = time_phases(filename, outfile, verbose=verbose)
+                if best is None:
+                    best = run
+                else:
+                    for phase in PHASES:
+                        best["seconds"][phase] = min(best["seconds"][phase], run["seconds"][phase])
+            best["rows"] = rows
+            results.append(best)
+            print_result(best)
+    return {"seed": seed, "repeat": repeat, "duplicate_fraction": duplicate_fraction, "results": results,
+            "scaling": scaling_exponents(results)}
+
+
+def print_result(result):
+    cells = [f"{phase} {result['seconds'][phase]:.3f}s" for phase in PHASES]
+    print(f"{result['rows']} rows\t{result['connections']} connections\t{result['triples']} triples\t" +
+          "\t".join(cells))
+
+
+def print_scaling(scaling):
+    # Flag anything growing clearly faster than linear
+    for step in scaling:
+        cells = []
+        for phase in PHASES:
+            exponent = step["exponents"].get(phase)
+            if exponent is None:
+                cells.append(f"{phase} -")
+            else:
+                cells.append(f"{phase} {exponent:.2f}{' SUPERLINEAR' if exponent > 1.5 else ''}")
+        print(f"{step['from_rows']} -> {step['to_rows']} rows\t" + "\t".join(cells))
+
+
+def main():
+    args = parser.parse_args()
+    report = run_benchmark(args.sizes, seed=args.seed, repeat=args.repeat,
+                           duplicate_fraction=args.duplicate_fraction, workdir=args.keep, verbose=args.verbose)
+    print("Scaling exponents (time ~ rows^k):")
+    print_scaling(report["scaling"])
+    if args.json:
+        with open(args.json, "w") as jf:
+            json.dump(report, jf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from array import array
+from rdflib.namespace import RDFS
+from rdflib.term import Literal
+
+
+class CausalGraph:
+    # Intermediate representation of a pathway model, built before anything goes into rdflib. Individuals are
+    # integer node ids and every column is a flat array:
+    #   node_classes[node]   -> index into classes (class CURIE of the individual)
+    #   edge_subjects[edge], edge_predicates[edge] (index into predicates), edge_objects[edge]
+    #   edge_evidence[edge]  -> index into evidence, or -1 for a plain axiom
+    # Wiring looks individuals up here instead of querying triples back out of the RDF graph. emit() then writes
+    # the whole thing to a SignorGoCamModel in one pass.
+    NO_EVIDENCE = -1
+
+    def __init__(self, complex_per_statement=False, metrics=None):
+        # Declare a new complex node for every statement instead of sharing one per distinct complex
+        self.complex_per_statement = complex_per_statement
+        # metrics.ConversionMetrics counting lookups, if any
+        self.metrics = metrics
+        self.classes = []
+        self._class_ids = {}
+        self.predicates = []
+        self._predicate_ids = {}
+        self.evidence = []
+        self._evidence_ids = {}
+        self.node_classes = array("i")
+        self.node_labels = {}
+        self.edge_subjects = array("i")
+        self.edge_predicates = array("i")
+        self.edge_objects = array("i")
+        self.edge_evidence = array("i")
+        self.nodes_by_class = {}
+        self.complexes_by_members = {}
+        # GoCamEvidence objects shared between statements, see PathwayConnection.gocam_evidence
+        self.evidence_cache = {}
+
+    def __len__(self):
+        return len(self.node_classes)
+
+    def edge_count(self):
+        return len(self.edge_subjects)
+
+    @staticmethod
+    def _intern(value, values, ids):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = len(values)
+            values.append(value)
+            ids[value] = value_id
+        return value_id
+
+    def add_node(self, class_curie, label=None):
+        class_id = self._intern(class_curie, self.classes, self._class_ids)
+        node = len(self.node_classes)
+        self.node_classes.append(class_id)
+        if label is not None:
+            self.node_labels[node] = label
+        self.nodes_by_class.setdefault(class_curie, []).append(node)
+        return node
+
+    def nodes_for_class(self, class_curie):
+        if self.metrics is not None:
+            self.metrics.count("graph_lookups")
+        return self.nodes_by_class.get(class_curie, [])
+
+    def complex_node(self, members):
+        # Node of the complex already added with these members, if any
+        if self.metrics is not None:
+            self.metrics.count("graph_lookups")
+        return self.complexes_by_members.get(members)
+
+    def add_edge(self, subject, predicate_uri, obj, evidence=None):
+        self.edge_subjects.append(subject)
+        self.edge_predicates.append(self._intern(predicate_uri, self.predicates, self._predicate_ids))
+        self.edge_objects.append(obj)
+        if evidence is None:
+            self.edge_evidence.append(self.NO_EVIDENCE)
+        else:
+            self.edge_evidence.append(self._intern(evidence, self.evidence, self._evidence_ids))
+
+    def class_of(self, node):
+        return self.classes[self.node_classes[node]]
+
+    def emit(self, model):
+        # Returns the URI of each node, indexed by node id. Repeated edges (same subject, predicate and object)
+        # become one statement with one axiom carrying all their evidence, so no triple is emitted twice.
+        uris = [model.declare_individual(self.classes[class_id]) for class_id in self.node_classes]
+        graph = model.writer.writer.graph
+        for node, label in self.node_labels.items():
+            graph.add((uris[node], RDFS.label, Literal(label)))
+        evidence_by_statement = {}
+        for subject, predicate, obj, evidence in zip(self.edge_subjects, self.edge_predicates, self.edge_objects,
+                                                     self.edge_evidence):
+            statement_evidence = evidence_by_statement.setdefault((subject, predicate, obj), {})
+            if evidence != self.NO_EVIDENCE:
+                statement_evidence[evidence] = None
+        for (subject, predicate, obj), evidence in evidence_by_statement.items():
+            statement = model.writer.emit(uris[subject], self.predicates[predicate], uris[obj])
+            axiom = model.add_axiom(statement)
+            if evidence:
+                model.add_evidence(axiom, [self.evidence[e] for e in evidence])
+        return uris
@@ -1,28 +1,227 @@
-import requests
+import csv
+import hashlib
+import json
 import os
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from urllib3.util.retry import Retry
+
+
+def pooled_session(pool_size=10, retries=3, backoff_factor=1.0) -> requests.Session:
+    # Connections are reused across requests (and threads) and failed requests are retried with
+    # exponential backoff: backoff_factor * 2 ** (retry - 1) seconds
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=None)  # SIGNOR downloads are POSTs too, all safe to repeat
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MirrorManifest:
+    # Records ETag/Last-Modified/SHA-256 for every file downloaded into a directory so the next run can make
+    # conditional requests and skip payloads that haven't changed
+    FILENAME = "signor_manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        self.entries = {}
+        self.changed = set()
+        self.unchanged = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as mf:
+                self.entries = json.load(mf)
+
+    def verified_sha256(self, file_basename):
+        # SHA-256 from the manifest, but only if the local file still has exactly that content
+        entry = self.entries.get(file_basename)
+        file_target = os.path.join(self.directory, file_basename)
+        if entry is None or not os.path.exists(file_target) or file_sha256(file_target) != entry.get("sha256"):
+            return None
+        return entry["sha256"]
+
+    def conditional_headers(self, file_basename, verified_sha256):
+        # verified_sha256 is what verified_sha256() returned for the file. Only worth asking if we still have the
+        # exact file the manifest describes.
+        if verified_sha256 is None:
+            return {}
+        entry = self.entries[file_basename]
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, file_basename, url, etag, last_modified, sha256, changed):
+        with self._lock:
+            self.entries[file_basename] = {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "sha256": sha256,
+            }
+            if changed:
+                self.changed.add(file_basename)
+            else:
+                self.unchanged.add(file_basename)
+
+    def mark_unchanged(self, file_basename):
+        with self._lock:
+            self.unchanged.add(file_basename)
+
+    def save(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as mf:
+                json.dump(self.entries, mf, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
 
 
 class SignorDownloader:
+    BASE_URL = "https://signor.uniroma2.it"
+    # (connect, read) seconds
+    TIMEOUT = (10, 300)
+    CHUNK_SIZE = 64 * 1024
+    _session = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = pooled_session()
+            return cls._session
+
     @staticmethod
-    def write_response_content(response: Response, file_basename, destination_dir=None):
+    def write_response_content(response: Response, file_basename, destination_dir=None, current_sha256=None):
+        # Returns (file path, SHA-256 of the content, whether the file was (re)written). Content matching
+        # current_sha256 leaves the existing file untouched.
         if destination_dir is None:
             destination_dir = "resources"
+        os.makedirs(destination_dir, exist_ok=True)
         file_target = os.path.join(destination_dir, file_basename)
-        with open(file_target, "wb") as ft:
-            ft.write(response.content)
-        return file_target
+        # Stream into a temp file next to the target and rename it into place so a failed download never
+        # leaves a truncated file behind
+        tmp_target = f"{file_target}.{os.getpid()}.{threading.get_ident()}.part"
+        sha = hashlib.sha256()
+        written = False
+        try:
+            with open(tmp_target, "wb") as ft:
+                for chunk in response.iter_content(chunk_size=SignorDownloader.CHUNK_SIZE):
+                    sha.update(chunk)
+                    ft.write(chunk)
+            if sha.hexdigest() != current_sha256:
+                os.replace(tmp_target, file_target)
+                written = True
+        finally:
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+        return file_target, sha.hexdigest(), written
 
-    @staticmethod
-    def download_complexes(destination_dir=None):
-        response = requests.post(url="https://signor.uniroma2.it/download_complexes.php",
-                                 data={"submit": "Download complex data"})
-        file_basename = "SIGNOR_complexes.csv"
-        return SignorDownloader.write_response_content(response, file_basename, destination_dir=destination_dir)
+    @classmethod
+    def fetch(cls, method, url, file_basename, destination_dir=None, session=None, manifest=None, **kwargs):
+        # manifest should be the MirrorManifest of destination_dir
+        if session is None:
+            session = cls.session()
+        if destination_dir is None:
+            destination_dir = "resources"
+        headers = {}
+        current_sha256 = None
+        if manifest is not None:
+            current_sha256 = manifest.verified_sha256(file_basename)
+            headers = manifest.conditional_headers(file_basename, current_sha256)
+        with session.request(method, url, stream=True, timeout=cls.TIMEOUT, headers=headers, **kwargs) as response:
+            if response.status_code == 304 and manifest is not None:
+                manifest.mark_unchanged(file_basename)
+                return os.path.join(destination_dir, file_basename)
+            response.raise_for_status()
+            file_target, sha256, written = cls.write_response_content(response, file_basename,
+                                                                      destination_dir=destination_dir,
+                                                                      current_sha256=current_sha256)
+            if manifest is not None:
+                manifest.record(file_basename, response.url, response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"), sha256, changed=written)
+            return file_target
 
-    @staticmethod
-    def download_families(destination_dir=None):
-        response = requests.post(url="https://signor.uniroma2.it/download_complexes.php",
-                                 data={"submit": "Download protein family data"})
-        file_basename = "SIGNOR_PF.csv"
-        return SignorDownloader.write_response_content(response, file_basename, destination_dir=destination_dir)
+    @classmethod
+    def download_complexes(cls, destination_dir=None, base_url=None, session=None, manifest=None):
+        if base_url is None:
+            base_url = cls.BASE_URL
+        return cls.fetch("POST", f"{base_url}/download_complexes.php", "SIGNOR_complexes.csv",
+                         destination_dir=destination_dir, session=session, manifest=manifest,
+                         data={"submit": "Download complex data"})
+
+    @classmethod
+    def download_families(cls, destination_dir=None, base_url=None, session=None, manifest=None):
+        if base_url is None:
+            base_url = cls.BASE_URL
+        return cls.fetch("POST", f"{base_url}/download_complexes.php", "SIGNOR_PF.csv",
+                         destination_dir=destination_dir, session=session, manifest=manifest,
+                         data={"submit": "Download protein family data"})
+
+    @classmethod
+    def download_reference_data(cls, destination_dir=None, base_url=None, session=None, manifest=None):
+        # Complexes and families side by side
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            complexes = executor.submit(cls.download_complexes, destination_dir, base_url, session, manifest)
+            families = executor.submit(cls.download_families, destination_dir, base_url, session, manifest)
+            return complexes.result(), families.result()
+
+    @classmethod
+    def pathway_list(cls, base_url=None, session=None):
+        if base_url is None:
+            base_url = cls.BASE_URL
+        if session is None:
+            session = cls.session()
+        response = session.get(f"{base_url}/getPathwayData.php?description", timeout=cls.TIMEOUT)
+        response.raise_for_status()
+        results = response.content.decode('utf-8').splitlines()
+        reader = csv.reader(results, delimiter="\t")
+        next(reader)  # skip over headers
+        pathway_list = set([r[0] for r in reader if r])
+        pathway_list.discard(' ')  # This is caused by weird separator: "^M    Daniela Posca"
+        return pathway_list
+
+    @classmethod
+    def download_pathway(cls, pathway_id, destination_dir, base_url=None, session=None, manifest=None):
+        # e.g. https://signor.uniroma2.it/getPathwayData.php?pathway=SIGNOR-MM&relations=only
+        if base_url is None:
+            base_url = cls.BASE_URL
+        return cls.fetch("GET", f"{base_url}/getPathwayData.php", f"{pathway_id}.tsv",
+                         destination_dir=destination_dir, session=session, manifest=manifest,
+                         params={"pathway": pathway_id, "relations": "only"})
+
+    @classmethod
+    def download_pathways(cls, pathway_ids, destination_dir, concurrency=4, base_url=None, session=None,
+                          manifest=None):
+        # Returns {pathway_id: file path or the exception that stopped it}, in sorted pathway_id order
+        if session is None:
+            session = cls.session()
+        pathway_ids = sorted(pathway_ids)
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {pthwy_id: executor.submit(cls.download_pathway, pthwy_id, destination_dir,
+                                                 base_url=base_url, session=session, manifest=manifest)
+                       for pthwy_id in pathway_ids}
+            for pthwy_id in pathway_ids:
+                try:
+                    results[pthwy_id] = futures[pthwy_id].result()
+                except Exception as e:
+                    results[pthwy_id] = e
+        return results
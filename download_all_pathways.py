@@ -1,44 +1,67 @@
-import requests
-import csv
 import argparse
-import os
+import sys
+from download import MirrorManifest, SignorDownloader, pooled_session
 
 parser = argparse.ArgumentParser()
-parser.add_argument('-d', '--dest_folder')
-args = parser.parse_args()
-
-# Get list of all pathways
-pathway_list_url = "https://signor.uniroma2.it/getPathwayData.php?description"
-response = requests.get(pathway_list_url)
-if response.status_code == 200:
-    results = response.content.decode('utf-8').splitlines()
-    reader = csv.reader(results, delimiter="\t")
-    next(reader)  # skip over headers
-    pathway_list = set([r[0] for r in reader])
-    pathway_list.remove(' ')  # This is caused by weird separator: "^M    Daniela Posca"
-    print(pathway_list)
-    # {'SIGNOR-NOTCH_Myogenesis', 'SIGNOR-P38', 'SIGNOR-TA', 'SIGNOR-SAPK-JNK', 'SIGNOR-P38_Myogenesis',
-    # 'SIGNOR-M1M2', 'SIGNOR-NOTCH', 'SIGNOR-RMS', 'SIGNOR-Autophagy', 'SIGNOR-PDAP', 'SIGNOR-WNT', 'SIGNOR-IL1R',
-    # 'SIGNOR-GCR', 'SIGNOR-Hedgehog', 'SIGNOR-PC', 'SIGNOR-HPP', 'SIGNOR-GBM', 'SIGNOR-DR', 'SIGNOR-AD',
-    # 'SIGNOR-MM', 'SIGNOR-WNT_Myogenesis', 'SIGNOR-AC', 'SIGNOR-HT', 'SIGNOR-AMPK', 'SIGNOR-MS', 'SIGNOR-TLR',
-    # 'SIGNOR-CRC', 'SIGNOR-AML-MiniPathway', 'SIGNOR-IOA', 'SIGNOR-NFKBC', 'SIGNOR-NS', 'SIGNOR-AML',
-    # 'SIGNOR-FapINS', 'SIGNOR-IS', 'SIGNOR-MCAPO', 'SIGNOR-G1-S_trans', 'SIGNOR-PD', 'SIGNOR-TCA', 'SIGNOR-LBC',
-    # 'SIGNOR-Myogenesis', 'SIGNOR-G2-M_trans', 'SIGNOR-TGFb', 'SIGNOR-TC', 'SIGNOR-NSCLCN', 'SIGNOR-INSR',
-    # 'SIGNOR-EGF', 'SIGNOR-IL6', 'SIGNOR-PI3K-AKT', 'SIGNOR-NFKBNC', 'SIGNOR-FSGS'}
+parser.add_argument('-d', '--dest_folder', required=True)
+parser.add_argument('-j', '--concurrency', type=int, default=4,
+                    help="Number of pathways to download at once. Defaults to 4")
+parser.add_argument('-r', '--retries', type=int, default=3,
+                    help="Retries per request, with exponential backoff. Defaults to 3")
+parser.add_argument('--base_url', default=SignorDownloader.BASE_URL,
+                    help=f"SIGNOR server to download from. Defaults to {SignorDownloader.BASE_URL}")
+parser.add_argument('--reference_data', action="store_true",
+                    help="Also download the SIGNOR complex and protein family CSVs into resources/")
+parser.add_argument('--changed_list', type=str,
+                    help="Write the paths of pathway files that changed in this run to this file, one per line. "
+                         "Can be passed to generate_all_models.py --manifest")
+parser.add_argument('--full', action="store_true",
+                    help=f"Ignore the {MirrorManifest.FILENAME} from previous runs and re-download everything")
+
+
+def main():
+    args = parser.parse_args()
+    session = pooled_session(pool_size=max(args.concurrency, 2), retries=args.retries)
+
+    # Get list of all pathways
+    pathway_list = SignorDownloader.pathway_list(base_url=args.base_url, session=session)
+    print(sorted(pathway_list))
     print(len(pathway_list), "pathways to download")
     print("Writing to", args.dest_folder)
 
-    # Get data for each pathway - e.g. https://signor.uniroma2.it/getPathwayData.php?pathway=SIGNOR-MM&relations=only
-    pathway_data_url = "https://signor.uniroma2.it/getPathwayData.php?pathway={}&relations=only"
-    for pthwy_id in pathway_list:
-        print("Getting", pthwy_id)
-        pthwy_resp = requests.get(pathway_data_url.format(pthwy_id))
-        if not os.path.exists(args.dest_folder):
-            os.makedirs(args.dest_folder)
-        dest_filename = f"{os.path.join(args.dest_folder, pthwy_id)}.tsv"
-        with open(dest_filename, "w+") as out_f:
-            out_f.write(pthwy_resp.content.decode('utf-8'))
+    # Conditional requests against what the last run recorded, so unchanged pathways aren't rewritten
+    manifest = MirrorManifest(args.dest_folder)
+    if args.full:
+        manifest.entries = {}
+    results = SignorDownloader.download_pathways(pathway_list, args.dest_folder, concurrency=args.concurrency,
+                                                 base_url=args.base_url, session=session, manifest=manifest)
+    manifest.save()
+    if args.reference_data:
+        reference_manifest = MirrorManifest("resources")
+        if args.full:
+            reference_manifest.entries = {}
+        SignorDownloader.download_reference_data(base_url=args.base_url, session=session,
+                                                 manifest=reference_manifest)
+        reference_manifest.save()
+        for file_basename in sorted(reference_manifest.changed):
+            print("Changed:", file_basename)
+
+    failed = {pthwy_id: result for pthwy_id, result in results.items() if isinstance(result, Exception)}
+    for pthwy_id, error in failed.items():
+        print("Failed to get", pthwy_id, error, file=sys.stderr)
+    changed_files = [results[pthwy_id] for pthwy_id in sorted(results)
+                     if f"{pthwy_id}.tsv" in manifest.changed]
+    for changed_file in changed_files:
+        print("Changed:", changed_file)
+    if args.changed_list:
+        with open(args.changed_list, "w") as cl:
+            for changed_file in changed_files:
+                cl.write(changed_file + "\n")
+    print(f"{len(results) - len(failed)} of {len(results)} pathways downloaded, {len(changed_files)} changed")
     print("done")
-else:
-    print(response.status_code, "Something other than success occurred:\n", response.content)
+    if failed:
+        sys.exit(1)
+
 
+if __name__ == '__main__':
+    main()
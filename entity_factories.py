@@ -1,16 +1,40 @@
 import csv
 import os
+import pickle
 from naming_conventions import NamingConvention
 from entity_models import SignorEntity, SignorProtein, SignorMicroRNA, SignorComplex, SignorProteinFamily, SignorSmallMolecule
 from download import SignorDownloader
 
 
+def offline_mode_from_env():
+    return os.environ.get("SIGNOR2GOCAM_OFFLINE", "") not in ["", "0"]
+
+
 class SignorGroupingFactory:
     NAME_FIELD = None
     GROUPING_CLASS = None
-
-    def __init__(self, filename):
-        self.grouping = {}
+    CACHE_DIR = "resources/.cache"
+    # Bump when the pickled grouping objects change shape
+    CACHE_VERSION = 2
+
+    def __init__(self, filename, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = self.CACHE_DIR
+        self.grouping = None
+        cache_file = None
+        cache_key = None
+        if cache_dir:
+            cache_file = os.path.join(cache_dir, os.path.basename(filename) + ".pickle")
+            stat = os.stat(filename)
+            cache_key = (self.CACHE_VERSION, self.GROUPING_CLASS.__name__, stat.st_size, stat.st_mtime_ns)
+            self.grouping = self.read_cache(cache_file, cache_key)
+        if self.grouping is None:
+            self.grouping = self.parse(filename)
+            if cache_file:
+                self.write_cache(cache_file, cache_key, self.grouping)
+
+    def parse(self, filename):
+        grouping = {}
         with open(filename, "r") as f:
             data = list(csv.DictReader(f, delimiter=";"))
 
@@ -26,42 +50,98 @@ class SignorGroupingFactory:
                     "entities": entities
                 }
                 sig_grouping = self.GROUPING_CLASS(**args)
-                self.grouping[sig_grouping.id] = sig_grouping
+                grouping[sig_grouping.id] = sig_grouping
+        return grouping
+
+    @staticmethod
+    def read_cache(cache_file, cache_key):
+        # Cache is keyed on the source CSV's size and mtime. Anything unreadable is treated as a miss.
+        try:
+            with open(cache_file, "rb") as cf:
+                cached = pickle.load(cf)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if cached.get("key") != cache_key:
+            return None
+        return cached["grouping"]
+
+    @staticmethod
+    def write_cache(cache_file, cache_key, grouping):
+        # Caching is best effort, e.g. resources/ may be read-only
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = cache_file + f".{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as cf:
+                pickle.dump({"key": cache_key, "grouping": grouping}, cf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+
+
+def missing_reference_file(filename, offline):
+    if offline:
+        raise FileNotFoundError(f"{filename} not found and offline mode is on. "
+                                f"Download it first or turn off SIGNOR2GOCAM_OFFLINE.")
 
 
 class SignorComplexFactory(SignorGroupingFactory):
     FILENAME = "resources/SIGNOR_complexes.csv"
+    NAME_FIELD = "COMPLEX NAME"
+    GROUPING_CLASS = SignorComplex
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, cache_dir=None, offline=False):
         if filename is None:
             filename = self.FILENAME
         if not os.path.exists(filename):
+            missing_reference_file(filename, offline)
             filename = SignorDownloader.download_complexes()
 
-        self.NAME_FIELD = "COMPLEX NAME"
-        self.GROUPING_CLASS = SignorComplex
-        SignorGroupingFactory.__init__(self, filename)
+        SignorGroupingFactory.__init__(self, filename, cache_dir=cache_dir)
         self.complexes = self.grouping
 
 
 class SignorProteinFamilyFactory(SignorGroupingFactory):
     FILENAME = "resources/SIGNOR_PF.csv"
+    NAME_FIELD = "PROT. FAMILY NAME"
+    GROUPING_CLASS = SignorProteinFamily
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, cache_dir=None, offline=False):
         if filename is None:
             filename = self.FILENAME
         if not os.path.exists(filename):
+            missing_reference_file(filename, offline)
             filename = SignorDownloader.download_families()
 
-        self.NAME_FIELD = "PROT. FAMILY NAME"
-        self.GROUPING_CLASS = SignorProteinFamily
-        SignorGroupingFactory.__init__(self, filename)
+        SignorGroupingFactory.__init__(self, filename, cache_dir=cache_dir)
         self.families = self.grouping
 
 
+class SignorEntityRegistry:
+    # Flyweight store so a protein/miRNA/small molecule showing up in many rows is a single shared object
+    def __init__(self):
+        self._entities = {}
+
+    def get_or_create(self, entity_class, entity_id: str, entity_name: str) -> SignorEntity:
+        key = (entity_class, entity_id, entity_name)
+        entity = self._entities.get(key)
+        if entity is None:
+            entity = entity_class(entity_id, entity_name)
+            self._entities[key] = entity
+        return entity
+
+    def clear(self):
+        self._entities = {}
+
+    def __len__(self):
+        return len(self._entities)
+
+
 class SignorEntityFactory:
-    complex_factory = SignorComplexFactory()
-    family_factory = SignorProteinFamilyFactory()
+    # Complex and family data is only loaded (and downloaded if missing) on first use
+    _complex_factory = None
+    _family_factory = None
+    offline = offline_mode_from_env()
+    registry = SignorEntityRegistry()
     entity_type_map = {
         'complex': SignorComplex,
         'protein': SignorProtein,
@@ -69,16 +149,28 @@ class SignorEntityFactory:
         'smallmolecule': SignorSmallMolecule
     }
 
+    @classmethod
+    def complex_factory(cls) -> SignorComplexFactory:
+        if cls._complex_factory is None:
+            cls._complex_factory = SignorComplexFactory(offline=cls.offline)
+        return cls._complex_factory
+
+    @classmethod
+    def family_factory(cls) -> SignorProteinFamilyFactory:
+        if cls._family_factory is None:
+            cls._family_factory = SignorProteinFamilyFactory(offline=cls.offline)
+        return cls._family_factory
+
     @classmethod
     def determine_entity(cls, entity_id: str, entity_name: str, entity_type: str) -> SignorEntity:
         if NamingConvention.is_complex(entity_id):
             return SignorEntityFactory.complex_from_id(entity_id)
         else:
-            return cls.entity_type_map[entity_type](entity_id, entity_name)
+            return cls.registry.get_or_create(cls.entity_type_map[entity_type], entity_id, entity_name)
 
     @classmethod
     def complex_from_id(cls, entity_id: str):
-        possible_complexes = cls.complex_factory.complexes
+        possible_complexes = cls.complex_factory().complexes
         if entity_id in possible_complexes:
             return possible_complexes[entity_id]
 
@@ -1,18 +1,18 @@
 import abc
-from ontobio.rdfgen.gocamgen import gocamgen
 from naming_conventions import NamingConvention
-from rdflib.term import URIRef, Literal
-from rdflib.namespace import RDFS
-from prefixcommons.curie_util import expand_uri
+from util import TERM_URIS
 
-HAS_PART = URIRef(expand_uri("BFO:0000051"))
+HAS_PART = TERM_URIS.add("BFO:0000051")
 
 
 class SignorEntity:
-    def __init__(self, entity_id, name, uri=None):
+    # Entities are interned and shared between PathwayConnections (see SignorEntityRegistry), so they only hold
+    # identity. Individual URIs declared in a model are kept on the PathwayConnection.
+    __slots__ = ("id", "name")
+
+    def __init__(self, entity_id, name):
         self.id = entity_id
         self.name = name
-        self.uri = uri
 
     def full_id(self):
         return NamingConvention.full_id(self.id)
@@ -31,35 +31,40 @@ class SignorEntity:
             return self.id == other.id and self.name == other.name
         return False
 
+    def __hash__(self):
+        return hash((self.id, self.name))
+
     def __str__(self):
         return f"{self.id} - {self.name}"
 
     @abc.abstractmethod
-    def declare(self, model: gocamgen.GoCamModel):
+    def add_to_graph(self, graph):
+        # Add this entity to a causal_graph.CausalGraph. Returns the node id.
         return
 
 
 class SignorProtein(SignorEntity):
-    def declare(self, model):
-        self.uri = model.declare_individual(self.full_id())
-        return self.uri
+    __slots__ = ()
+
+    def add_to_graph(self, graph):
+        return graph.add_node(self.full_id())
 
 
 class SignorMicroRNA(SignorEntity):
-    def declare(self, model):
-        self.uri = model.declare_individual(self.full_id())
-        return self.uri
+    __slots__ = ()
+
+    def add_to_graph(self, graph):
+        return graph.add_node(self.full_id())
 
 
 class SignorSmallMolecule(SignorEntity):
-    def declare(self, model):
-        # First, check if instance already exists
-        existing_uris = model.uri_list_for_individual(self.full_id())
-        if len(existing_uris) > 0:
-            self.uri = existing_uris[0]
-        else:
-            self.uri = model.declare_individual(self.full_id())
-        return self.uri
+    __slots__ = ()
+
+    def add_to_graph(self, graph):
+        existing_nodes = graph.nodes_for_class(self.full_id())
+        if len(existing_nodes) > 0:
+            return existing_nodes[0]
+        return graph.add_node(self.full_id())
 
     def full_id(self):
         if self.id.startswith("CHEBI:"):
@@ -69,49 +74,33 @@ class SignorSmallMolecule(SignorEntity):
 
 
 class SignorGrouping(SignorEntity):
+    __slots__ = ("entities",)
+
     def __init__(self, signor_id, name, entities):
         SignorEntity.__init__(self, signor_id, name)
         self.entities = entities
 
 
 class SignorComplex(SignorGrouping):
-    def declare(self, model):
-        return self.declare_entities(model)
-
-    def declare_entities(self, model):
-        self.uri = model.declare_individual("GO:0032991")
-        model.writer.writer.graph.add((self.uri, RDFS.label, Literal(str(self.name))))
+    __slots__ = ()
+
+    def member_key(self):
+        return frozenset(self.entities)
+
+    def add_to_graph(self, graph):
+        # A complex is added once per graph and shared by every statement it's in, unless the graph asks for one
+        # complex node per statement
+        if not graph.complex_per_statement:
+            node = graph.complex_node(self.member_key())
+            if node is not None:
+                return node
+        node = graph.add_node("GO:0032991", label=str(self.name))
         for entity in self.entities:
-            entity_full_id = NamingConvention.full_id(entity)
-            entity_uri = model.declare_individual(entity_full_id)
-            part_of_stmt = model.writer.emit(self.uri, HAS_PART, entity_uri)
-            model.add_axiom(part_of_stmt)
-            "uri BFO:0000051 entity_uri"
-        return self.uri
-
-    def uri_in_model(self, model):
-        graph = model.writer.writer.graph
-        complex_term = "GO:0032991"
-        complex_uris = model.uri_list_for_individual(complex_term)
-        for c_uri in complex_uris:
-            found_entities = [] # Collect connected entities for set comparison
-            for entity in self.entities:
-                for entity_uri in model.uri_list_for_individual(NamingConvention.full_id(entity)):
-                    if (c_uri, HAS_PART, entity_uri) in graph:
-                        found_entities.append(entity)
-            if set(self.entities) == set(found_entities):
-                print(c_uri)
-                return c_uri
+            entity_node = graph.add_node(NamingConvention.full_id(entity))
+            graph.add_edge(node, HAS_PART, entity_node)
+        graph.complexes_by_members.setdefault(self.member_key(), node)
+        return node
 
 
 class SignorProteinFamily(SignorGrouping):
-    def declare_entities(self, model):
-        uri = model.declare_individual("GO:0032991")
-        model.writer.writer.graph.add((uri, RDFS.label, Literal(str(self.name))))
-        for entity in self.entities:
-            entity_full_id = NamingConvention.full_id(entity)
-            entity_uri = model.declare_individual(entity_full_id)
-            part_of_stmt = model.writer.emit(uri, HAS_PART, entity_uri)
-            model.add_axiom(part_of_stmt)
-            "uri BFO:0000051 entity_uri"
-        return uri
+    __slots__ = ()
@@ -0,0 +1,366 @@
+import argparse
+import ast
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+from download import MirrorManifest
+from entity_factories import SignorEntityFactory, SignorComplexFactory, SignorProteinFamilyFactory
+from pathway_connections import open_pathway_file
+from pathway_importer import generate_model
+from triple_stream import open_output, open_triple_stream, output_format
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-d', "--input_dir", type=str,
+                    help="Directory of SIGNOR pathway files to convert")
+parser.add_argument('-m', "--manifest", type=str,
+                    help="File listing SIGNOR pathway files to convert, one path per line")
+parser.add_argument('-o', "--outdir", type=str,
+                    help="Output directory for generated models")
+parser.add_argument("--dataset", type=str,
+                    help="Write every model into this one N-Quads file (.nq or .nq.gz), each in its own named graph, "
+                         "instead of a .ttl per pathway in --outdir")
+parser.add_argument('-j', "--jobs", type=int, default=1,
+                    help="Number of pathways to convert in parallel worker processes. Defaults to 1")
+parser.add_argument("--offline", action="store_true",
+                    help="Fail instead of downloading missing SIGNOR complex data")
+parser.add_argument("--force", action="store_true",
+                    help="Regenerate every model, even those whose inputs haven't changed since the last run")
+parser.add_argument("--complex_per_statement", action="store_true",
+                    help="Declare a separate complex individual for each statement instead of one per complex")
+
+# Bump when the generated models change for the same inputs in a way the source fingerprint below can't see,
+# e.g. after upgrading ontobio
+CONVERTER_VERSION = "1"
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Everything in metadata/, so a new mapping or rule file is fingerprinted without being listed here
+METADATA_DIR = "metadata"
+METADATA_FILES = [os.path.join(METADATA_DIR, f) for f in sorted(os.listdir(METADATA_DIR))] + \
+                 [SignorComplexFactory.FILENAME, SignorProteinFamilyFactory.FILENAME]
+
+
+class ConversionResult:
+    def __init__(self, filename, outfile, error=None, skipped=False):
+        self.filename = filename
+        self.outfile = outfile
+        self.error = error
+        # Model was already up to date
+        self.skipped = skipped
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+def _update_sha(sha, filename):
+    if not os.path.exists(filename):
+        sha.update(b"missing")
+        return
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+
+
+def converter_sources(entry_point="pathway_importer.py", source_dir=SOURCE_DIR):
+    # The entry point plus every module of this repo it imports, directly or not, so the fingerprint can't miss a
+    # module that's added to the converter later
+    sources = []
+    pending = [entry_point]
+    while pending:
+        source = pending.pop()
+        if source in sources:
+            continue
+        sources.append(source)
+        with open(os.path.join(source_dir, source)) as f:
+            tree = ast.parse(f.read(), filename=source)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                module_file = module.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(source_dir, module_file)):
+                    pending.append(module_file)
+    return sorted(sources)
+
+
+CONVERTER_SOURCES = converter_sources()
+
+
+def shared_fingerprint(complex_per_statement=False):
+    # Everything every model depends on: converter code, version and options plus the metadata and reference data
+    sha = hashlib.sha256(CONVERTER_VERSION.encode())
+    if complex_per_statement:
+        sha.update(b"complex_per_statement")
+    for f in CONVERTER_SOURCES:
+        sha.update(f.encode())
+        _update_sha(sha, os.path.join(SOURCE_DIR, f))
+    for f in METADATA_FILES:
+        sha.update(f.encode())
+        _update_sha(sha, f)
+    return sha.hexdigest()
+
+
+def model_fingerprint(filename, shared):
+    sha = hashlib.sha256(shared.encode())
+    _update_sha(sha, filename)
+    return sha.hexdigest()
+
+
+class BuildCache:
+    # Fingerprint of the inputs each model in outdir was last generated from
+    FILENAME = ".signor2gocam_build.json"
+
+    def __init__(self, outdir):
+        self.path = os.path.join(outdir, self.FILENAME)
+        self.fingerprints = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as cf:
+                    self.fingerprints = json.load(cf)
+            except ValueError:
+                pass  # Corrupt cache means everything gets rebuilt
+
+    def is_current(self, outfile, fingerprint):
+        return self.fingerprints.get(os.path.basename(outfile)) == fingerprint and os.path.exists(outfile)
+
+    def record(self, outfile, fingerprint):
+        self.fingerprints[os.path.basename(outfile)] = fingerprint
+
+    def forget(self, outfile):
+        self.fingerprints.pop(os.path.basename(outfile), None)
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as cf:
+            json.dump(self.fingerprints, cf, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def pathway_files(input_dir=None, manifest=None) -> List[str]:
+    filenames = []
+    if input_dir:
+        for f in sorted(os.listdir(input_dir)):
+            if f == MirrorManifest.FILENAME:
+                continue  # left by download_all_pathways.py
+            filenames.append(os.path.join(input_dir, f))
+    if manifest:
+        with open(manifest) as mf:
+            for line in mf:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    filenames.append(line)
+    return filenames
+
+
+def pathway_basename(filename):
+    f_base = os.path.basename(filename)
+    for ext in [".gz", ".tsv"]:
+        if f_base.endswith(ext):
+            f_base = f_base[:-len(ext)]
+    return f_base
+
+
+def pathway_title(filename):
+    # Same as what generate_all_models.sh used to do: pathway_name column of the first data row
+    with open_pathway_file(filename) as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader, None)  # skip header
+        first_row = next(reader, None)
+    if first_row and len(first_row) > 1 and first_row[1]:
+        return f"SIGNOR - {first_row[1]}"
+    return f"SIGNOR - {pathway_basename(filename)}"
+
+
+def pathway_outfile(filename, outdir):
+    return os.path.join(outdir, f"{pathway_basename(filename)}.ttl")
+
+
+def convert_pathway(filename, outdir, complex_per_statement=False) -> ConversionResult:
+    outfile = pathway_outfile(filename, outdir)
+    try:
+        model = generate_model(filename, pathway_title(filename), complex_per_statement=complex_per_statement)
+        model.write(outfile)
+    except Exception:
+        return ConversionResult(filename, outfile, error=traceback.format_exc())
+    return ConversionResult(filename, outfile)
+
+
+def convert_pathway_quads(filename, partdir, complex_per_statement=False) -> ConversionResult:
+    # Model streamed as N-Quads into its own file in partdir, named graph = model IRI
+    outfile = os.path.join(partdir, f"{pathway_basename(filename)}.nq")
+    try:
+        with open_triple_stream(outfile) as store:
+            generate_model(filename, pathway_title(filename), complex_per_statement=complex_per_statement,
+                           store=store)
+    except Exception:
+        return ConversionResult(filename, outfile, error=traceback.format_exc())
+    return ConversionResult(filename, outfile)
+
+
+def convert_dataset(filenames, dataset, jobs=1, complex_per_statement=False) -> List[ConversionResult]:
+    # One N-Quads file for bulk loading into a triplestore. Each pathway is streamed to a part file and appended
+    # to the dataset as soon as it finishes, so only one model per worker is ever held in memory and a pathway
+    # that fails halfway doesn't leave half a graph in the dataset. The whole dataset is always rewritten, the
+    # build cache only applies to per-pathway models.
+    SignorEntityFactory.complex_factory()
+    dataset_dir = os.path.dirname(os.path.abspath(dataset))
+    os.makedirs(dataset_dir, exist_ok=True)
+    partdir = tempfile.mkdtemp(prefix=".signor2gocam_parts", dir=dataset_dir)
+    tmp_dataset = f"{dataset}.{os.getpid()}.tmp{'.gz' if dataset.endswith('.gz') else ''}"
+    try:
+        with open_output(tmp_dataset) as out:
+            def append_model(result):
+                if result.succeeded:
+                    with open(result.outfile, encoding="utf-8") as part:
+                        shutil.copyfileobj(part, out)
+                if os.path.exists(result.outfile):
+                    os.remove(result.outfile)
+                result.outfile = dataset
+
+            if jobs > 1:
+                results = convert_all_parallel(filenames, partdir, jobs, complex_per_statement=complex_per_statement,
+                                               convert=convert_pathway_quads, on_result=append_model)
+            else:
+                results = []
+                for filename in filenames:
+                    print("Converting", filename)
+                    result = convert_pathway_quads(filename, partdir, complex_per_statement=complex_per_statement)
+                    append_model(result)
+                    results.append(result)
+        os.replace(tmp_dataset, dataset)
+    finally:
+        if os.path.exists(tmp_dataset):
+            os.remove(tmp_dataset)
+        shutil.rmtree(partdir, ignore_errors=True)
+    return results
+
+
+def convert_all(filenames, outdir, jobs=1, force=False, complex_per_statement=False) -> List[ConversionResult]:
+    # Mechanism/ORCID mappings were loaded once when pathway_importer was imported. Complexes are loaded
+    # lazily, so do it now before any pathway (or forked worker) needs them. This also downloads the complex
+    # CSV if it's missing, so it has to happen before fingerprinting.
+    os.makedirs(outdir, exist_ok=True)
+    SignorEntityFactory.complex_factory()
+
+    # Skip models whose pathway file, metadata and converter are the same as when they were last generated
+    build_cache = BuildCache(outdir)
+    shared = shared_fingerprint(complex_per_statement=complex_per_statement)
+    fingerprints = [model_fingerprint(filename, shared) for filename in filenames]
+    results = [None] * len(filenames)
+    to_convert = []
+    for i, filename in enumerate(filenames):
+        outfile = pathway_outfile(filename, outdir)
+        if not force and build_cache.is_current(outfile, fingerprints[i]):
+            results[i] = ConversionResult(filename, outfile, skipped=True)
+        else:
+            to_convert.append(i)
+
+    convert_filenames = [filenames[i] for i in to_convert]
+    if jobs > 1:
+        converted = convert_all_parallel(convert_filenames, outdir, jobs,
+                                         complex_per_statement=complex_per_statement)
+    else:
+        converted = []
+        for filename in convert_filenames:
+            print("Converting", filename)
+            converted.append(convert_pathway(filename, outdir, complex_per_statement=complex_per_statement))
+
+    for i, result in zip(to_convert, converted):
+        results[i] = result
+        if result.succeeded:
+            build_cache.record(result.outfile, fingerprints[i])
+        else:
+            build_cache.forget(result.outfile)
+    build_cache.save()
+    return results
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def convert_all_parallel(filenames, outdir, jobs, complex_per_statement=False, convert=convert_pathway,
+                         on_result=None) -> List[ConversionResult]:
+    # Each generate_model() builds its own GoCamModel so pathways convert independently. Forked workers
+    # inherit the reference data already loaded in this process; where fork isn't available each worker
+    # loads it once on import rather than once per pathway.
+    # on_result is called in this process with each result as soon as its pathway finishes.
+    mp_context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+    # Largest pathways first so a big one isn't left running alone at the end
+    schedule = sorted(range(len(filenames)), key=lambda i: _file_size(filenames[i]), reverse=True)
+    results = [None] * len(filenames)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as executor:
+        futures = {}
+        for i in schedule:
+            print("Converting", filenames[i])
+            futures[executor.submit(convert, filenames[i], outdir, complex_per_statement)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception:
+                # e.g. the worker process died
+                outfile = pathway_outfile(filenames[i], outdir)
+                results[i] = ConversionResult(filenames[i], outfile, error=traceback.format_exc())
+            if on_result is not None:
+                on_result(results[i])
+    # Results come back in input order regardless of which worker finished first
+    return results
+
+
+def print_summary(results: List[ConversionResult]):
+    failed = [r for r in results if not r.succeeded]
+    skipped = [r for r in results if r.skipped]
+    for r in results:
+        status = "OK" if r.succeeded else "FAILED"
+        if r.skipped:
+            status = "UNCHANGED"
+        print(f"{status}\t{r.filename}\t{r.outfile}")
+    for r in failed:
+        print(f"\n{r.filename} failed:\n{r.error}", file=sys.stderr)
+    print(f"{len(results) - len(failed)} of {len(results)} pathways converted ({len(skipped)} unchanged)")
+
+
+def main():
+    args = parser.parse_args()
+    if not args.input_dir and not args.manifest:
+        parser.error("one of --input_dir or --manifest is required")
+    if bool(args.outdir) == bool(args.dataset):
+        parser.error("give either --outdir for a model per pathway or --dataset for one N-Quads dataset")
+    if args.dataset and args.force:
+        parser.error("--force only applies to --outdir: the --dataset is always rewritten in full")
+    if args.dataset and output_format(args.dataset) != "nq":
+        parser.error("--dataset must be an N-Quads file ending in .nq or .nq.gz")
+
+    if args.offline:
+        SignorEntityFactory.offline = True
+    filenames = pathway_files(args.input_dir, args.manifest)
+    if args.dataset:
+        results = convert_dataset(filenames, args.dataset, jobs=args.jobs,
+                                  complex_per_statement=args.complex_per_statement)
+    else:
+        results = convert_all(filenames, args.outdir, jobs=args.jobs, force=args.force,
+                              complex_per_statement=args.complex_per_statement)
+    print_summary(results)
+    if not all(r.succeeded for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+from ontobio.rdfgen.assoc_rdfgen import genid
+from ontobio.rdfgen.gocamgen import gocamgen
+from rdflib.namespace import DC, OWL, RDFS
+from rdflib.term import Literal, URIRef
+
+LEGO_EVIDENCE = URIRef("http://geneontology.org/lego/evidence")
+PROVIDED_BY = URIRef("http://purl.org/pav/providedBy")
+
+
+class SignorGoCamModel(gocamgen.GoCamModel):
+    # GoCamModel that keeps a side index of what has been declared so the lookups done while generating a model
+    # are dict lookups instead of graph scans:
+    #   class CURIE -> individual URIs, in declaration order (uri_list_for_individual, triples_by_ids)
+    #   (subject, predicate, object) -> owl:Axiom node (find_bnode, add_axiom)
+    #   evidence (code, references, date, ...) -> evidence individual, so identical evidence is emitted once
+    # Only declarations and axioms made through this model are indexed, so don't add those to the graph directly.
+    def __init__(self, modeltitle, metrics=None, **kwargs):
+        # metrics.ConversionMetrics counting declarations, axioms and lookups, if any
+        self.metrics = metrics
+        self.individuals_by_class = {}
+        self.axioms_by_statement = {}
+        self.object_properties = set()
+        self.class_uris = {}
+        self.evidence_ids = {}
+        gocamgen.GoCamModel.__init__(self, modeltitle, **kwargs)
+
+    def class_uri(self, class_curie):
+        # writer.uri() also binds the CURIE prefix in this model's graph, so it's memoized per model
+        uri = self.class_uris.get(class_curie)
+        if uri is None:
+            uri = self.writer.uri(class_curie)
+            self.class_uris[class_curie] = uri
+        return uri
+
+    def declare_individual(self, entity_id, evidences=None, negated=False):
+        if self.metrics is not None:
+            self.metrics.count("declare_individual")
+        if evidences or negated:
+            uri = gocamgen.GoCamModel.declare_individual(self, entity_id, evidences=evidences, negated=negated)
+        else:
+            # Same as GoCamModel.declare_individual without re-expanding the class CURIE every time
+            uri = genid(base=self.writer.writer.base + '/')
+            self.writer.emit_type(uri, self.class_uri(entity_id))
+            self.writer.emit_type(uri, OWL.NamedIndividual)
+            self.individuals[entity_id] = uri
+        if not negated:
+            self.individuals_by_class.setdefault(entity_id, []).append(uri)
+        return uri
+
+    def uri_list_for_individual(self, individual):
+        if self.metrics is not None:
+            self.metrics.count("model_lookups")
+        return list(self.individuals_by_class.get(individual, []))
+
+    @staticmethod
+    def evidence_key(evidence):
+        return (evidence.evidence_code, frozenset(evidence.references), evidence.date,
+                tuple(evidence.contributors), tuple(evidence.provided_bys), tuple(evidence.comments),
+                evidence.with_from)
+
+    def add_evidence(self, axiom, evidences):
+        # Same as GoCamModel.add_evidence for every evidence of one axiom, except each evidence individual is only
+        # created the first time and annotations the evidences share (comment, contributor, date...) are emitted
+        # once. Triples are never emitted twice, so a TripleStreamStore doesn't have to remember what it wrote.
+        annotations = []
+        for evidence in evidences:
+            key = self.evidence_key(evidence)
+            ev_id = self.evidence_ids.get(key)
+            if ev_id is None:
+                ev_id = self.writer.create_evidence(evidence)
+                self.evidence_ids[key] = ev_id
+            annotations.append((LEGO_EVIDENCE, ev_id))
+            annotations.append((RDFS.comment, Literal(evidence.source_line)))
+            annotations.extend((DC.contributor, Literal(c)) for c in evidence.contributors)
+            annotations.extend((PROVIDED_BY, Literal(pb)) for pb in evidence.provided_bys)
+            annotations.append((DC.date, Literal(evidence.date)))
+        for predicate, obj in dict.fromkeys(annotations):
+            self.writer.emit(axiom, predicate, obj)
+
+    def find_bnode(self, triple):
+        if self.metrics is not None:
+            self.metrics.count("model_lookups")
+        return self.axioms_by_statement.get(tuple(triple))
+
+    def add_axiom(self, statement, evidence=None):
+        # Same triples as GoCamModel.add_axiom, but a statement only gets its owl:Axiom once and each property is
+        # only typed owl:ObjectProperty once per model. Pass all the evidence of a statement to add_evidence()
+        # in one go rather than adding the statement again for each.
+        if self.metrics is not None:
+            self.metrics.count("add_axiom")
+        statement = tuple(statement)
+        axiom_id = self.axioms_by_statement.get(statement)
+        if axiom_id is None:
+            source_id, property_id, target_id = statement
+            axiom_id = self.writer.blanknode()
+            self.writer.emit_type(axiom_id, OWL.Axiom)
+            self.writer.emit(axiom_id, OWL.annotatedSource, source_id)
+            self.writer.emit(axiom_id, OWL.annotatedProperty, property_id)
+            self.writer.emit(axiom_id, OWL.annotatedTarget, target_id)
+            if property_id not in self.object_properties:
+                self.object_properties.add(property_id)
+                self.writer.emit_type(property_id, OWL.ObjectProperty)
+            self.axioms_by_statement[statement] = axiom_id
+        if evidence:
+            self.add_evidence(axiom_id, [evidence])
+        return axiom_id
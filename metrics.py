@@ -0,0 +1,85 @@
+import collections
+import contextlib
+import cProfile
+import json
+import time
+import tracemalloc
+
+
+class ConversionMetrics:
+    # Wall time per phase of a conversion plus counters of the work done in it (individuals declared, axioms
+    # added, lookups...). Hand one to generate_model(metrics=...) and it's threaded through to the CausalGraph
+    # and SignorGoCamModel doing the work. callback(phase, seconds, metrics) is called as each phase finishes.
+    # With trace_memory, the tracemalloc peak of each phase is recorded too (tracing is started if it isn't on).
+    def __init__(self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.seconds = collections.OrderedDict()
+        self.peak_memory = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def stop_tracing(self):
+        # tracemalloc slows everything down, so turn it back off if it was started for these metrics
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            # Phases can be entered more than once, e.g. per statement, so they add up
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peak_memory[name] = max(self.peak_memory.get(name, 0), peak)
+            if self.callback is not None:
+                self.callback(name, elapsed, self)
+
+    def add_seconds(self, name, seconds):
+        # Time measured by the caller, e.g. summed over many short stretches that aren't worth a phase() each
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def as_dict(self):
+        metrics = {"seconds": dict(self.seconds), "counts": dict(self.counts)}
+        if self.trace_memory:
+            metrics["peak_memory_bytes"] = dict(self.peak_memory)
+        return metrics
+
+    def write_json(self, filename):
+        with open(filename, "w") as mf:
+            json.dump(self.as_dict(), mf, indent=2)
+
+    def report(self):
+        lines = []
+        for name, seconds in self.seconds.items():
+            line = f"{name}\t{seconds:.3f}s"
+            if name in self.peak_memory:
+                line += f"\tpeak {self.peak_memory[name] / (1024 * 1024):.1f} MiB"
+            lines.append(line)
+        for name, count in sorted(self.counts.items()):
+            lines.append(f"{name}\t{count}")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def cprofile_to(filename):
+    # cProfile whatever runs inside, stats written to filename (read with python -m pstats or snakeviz)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(filename)
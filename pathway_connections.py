@@ -1,20 +1,26 @@
+import contextlib
 import csv
+import gzip
+import io
 import itertools
+import os
+import sys
 import yaml
 import datetime
-from typing import List
+import functools
+from types import MappingProxyType
+from typing import Dict, List
 from copy import copy
+from operator import itemgetter
 from ontobio.vocabulary.relations import OboRO
-from rdflib.term import URIRef
-from prefixcommons.curie_util import expand_uri
 from entity_factories import SignorEntityFactory
 from entity_models import SignorEntity
 from ontobio.rdfgen.gocamgen import gocamgen
-from util import OntologyTerm
+from util import OntologyTerm, TERM_URIS
 
 ro = OboRO()
 
-ENABLED_BY = URIRef(expand_uri(ro.enabled_by))
+ENABLED_BY = TERM_URIS.add(ro.enabled_by)
 
 
 class MechanismToGoMapping:
@@ -27,61 +33,259 @@ class MechanismToGoMapping:
 
 class MechanismToGoMappingSet:
     def __init__(self, mapping_file=None):
-        self.mappings = []
+        mappings = []
         if mapping_file:
             with open(mapping_file) as mf:
                 mappings = yaml.safe_load(mf)
-            for m in mappings:
-                self.mappings.append(MechanismToGoMapping(
-                    mechanism=m["MECHANISM"],
-                    mi_id=m["MI_ID"],
-                    go_id=m["GO_ID"],
-                    relation=m["RELATION"]
-                ))
+        self.mappings = tuple(MechanismToGoMapping(
+            mechanism=m["MECHANISM"],
+            mi_id=m["MI_ID"],
+            go_id=m["GO_ID"],
+            relation=m["RELATION"]
+        ) for m in mappings)
+        # Lookup tables are built once here since go_id_by_mechanism() is hit for every parsed row.
+        # First mapping with a GO ID wins, same as the old list scan.
+        go_ids = {}
+        for m in self.mappings:
+            if m.go_id:
+                go_ids.setdefault(m.mechanism, m.go_id)
+        self._go_id_by_mechanism = MappingProxyType(go_ids)
+        # Unspecified mechanisms are OK
+        self._acceptable_mechanisms = frozenset(go_ids) | {""}
+        TERM_URIS.add_all(go_ids.values())
+        TERM_URIS.add("GO:0003674")
+
+    def go_ids(self):
+        # Every mechanism term a connection can end up with, root MF included
+        return frozenset(self._go_id_by_mechanism.values()) | {"GO:0003674"}
 
     def go_id_by_mechanism(self, mechanism):
-        for m in self.mappings:
-            if m.mechanism == mechanism and m.go_id:
-                return m.go_id
         # Fallback on root MF
-        return "GO:0003674"
+        return self._go_id_by_mechanism.get(mechanism, "GO:0003674")
 
     def acceptable_mechanisms(self):
-        mechanisms = set()
-        for m in self.mappings:
-            if m.go_id:
-                mechanisms.add(m.mechanism)
-        mechanisms.add("")  # Unspecified mechanisms are OK
-        return mechanisms
+        return self._acceptable_mechanisms
 
 
 class AnnotatorOrcidMapping:
+    ORCID_PREFIX = "http://orcid.org/"
+
     def __init__(self, annotator_name, orcid: str):
         self.annotator_name = annotator_name
         self.orcid = orcid
+        if orcid.startswith(self.ORCID_PREFIX):
+            self._full_orcid_uri = orcid
+        else:
+            self._full_orcid_uri = self.ORCID_PREFIX + orcid
 
     def full_orcid_uri(self):
-        orcid_prefix = "http://orcid.org/"
-        if self.orcid.startswith(orcid_prefix):
-            return self.orcid
-        return orcid_prefix + self.orcid
+        return self._full_orcid_uri
+
 
 class AnnotatorOrcidMappingSet:
     def __init__(self, file=None):
-        self.mappings = []
+        mappings = []
         if file:
             with open(file) as mf:
                 mappings = list(csv.DictReader(mf, delimiter="\t"))
-                for m in mappings:
-                    self.mappings.append(AnnotatorOrcidMapping(
-                        annotator_name=m["ANNOTATOR"],
-                        orcid=m["ORCID"],
-                    ))
+        self.mappings = tuple(AnnotatorOrcidMapping(
+            annotator_name=m["ANNOTATOR"],
+            orcid=m["ORCID"],
+        ) for m in mappings)
+        orcid_uris = {}
+        for m in self.mappings:
+            orcid_uris.setdefault(m.annotator_name, m.full_orcid_uri())
+        self._orcid_by_name = MappingProxyType(orcid_uris)
 
     def orcid_by_name(self, annotator_name):
-        for m in self.mappings:
-            if m.annotator_name == annotator_name:
-                return m.full_orcid_uri()
+        return self._orcid_by_name.get(annotator_name)
+
+
+class MechanismPrecedenceRule:
+    def __init__(self, preferred, dropped):
+        self.preferred = preferred
+        self.dropped = frozenset(dropped)
+
+
+class MechanismPrecedenceRuleSet:
+    def __init__(self, rule_file=None):
+        self.rules = []
+        if rule_file:
+            with open(rule_file) as rf:
+                rules = yaml.safe_load(rf)
+            for r in rules:
+                self.rules.append(MechanismPrecedenceRule(
+                    preferred=r["PREFERRED"],
+                    dropped=r["DROPPED"]
+                ))
+
+    def connections_to_drop(self, connections):
+        # connections should all share the same entity A/B pair. Rules are checked against the mechanisms
+        # present before anything is dropped so the result doesn't depend on rule or connection order.
+        mechanism_terms = set(pc.mechanism.term for pc in connections)
+        dropped_terms = set()
+        for rule in self.rules:
+            if rule.preferred in mechanism_terms:
+                dropped_terms |= rule.dropped
+        return [pc for pc in connections if pc.mechanism.term in dropped_terms]
+
+
+class MechanismRule:
+    # Match conditions shared by RELATIONS and INTERMEDIARY_PROCESSES rules. None matches anything.
+    def __init__(self, mechanism=None, entity_a_type=None, effect=None, direct=None):
+        self.mechanism = mechanism
+        self.entity_a_type = entity_a_type
+        self.effect = effect
+        self.direct = direct
+
+
+class RelationRule(MechanismRule):
+    def __init__(self, relation: OntologyTerm, **conditions):
+        MechanismRule.__init__(self, **conditions)
+        self.relation = relation
+
+
+class IntermediaryProcessRule(MechanismRule):
+    def __init__(self, process, upstream_relation: OntologyTerm, downstream_relation: OntologyTerm, **conditions):
+        MechanismRule.__init__(self, **conditions)
+        self.process = process
+        self.upstream_relation = upstream_relation
+        self.downstream_relation = downstream_relation
+
+
+class MechanismRuleSet:
+    # Rules are compiled into dicts keyed by (mechanism term, entity A type, effect class, direct) so each lookup
+    # is at most two dict hits: the connection's own mechanism, then rules that didn't name one.
+    # Relations are also resolved up front for every combination of mechanism_terms, entity class, effect string
+    # in EFFECTS and direct, so determine_relation() is a single dict hit for anything SIGNOR is known to emit.
+    EFFECT_CLASSES = ("up-regulates", "down-regulates", "unknown", None)
+
+    def __init__(self, rule_file=None, mechanism_terms=()):
+        self.relation_rules = []
+        self.intermediary_process_rules = []
+        # effect string -> effect class
+        self._effect_classes = {}
+        # Effect strings seen that aren't in EFFECTS, each reported the first time it shows up
+        self.unknown_effects = set()
+        if rule_file:
+            with open(rule_file) as rf:
+                rules = yaml.safe_load(rf)
+            for effect_class, effects in (rules.get("EFFECTS") or {}).items():
+                for effect in effects:
+                    self._effect_classes[effect] = effect_class
+            for r in rules.get("RELATIONS") or []:
+                self.relation_rules.append(RelationRule(
+                    relation=OntologyTerm(r["RELATION"]),
+                    **self.rule_conditions(r)
+                ))
+            for r in rules.get("INTERMEDIARY_PROCESSES") or []:
+                self.intermediary_process_rules.append(IntermediaryProcessRule(
+                    process=r["PROCESS"],
+                    upstream_relation=OntologyTerm(r["UPSTREAM_RELATION"]),
+                    downstream_relation=OntologyTerm(r["DOWNSTREAM_RELATION"]),
+                    **self.rule_conditions(r)
+                ))
+        # Entity classes are matched exactly, by the SIGNOR type they're created from
+        self.entity_types = {entity_class: entity_type
+                             for entity_type, entity_class in SignorEntityFactory.entity_type_map.items()}
+        self._relations = self.compile(self.relation_rules)
+        self._intermediary_processes = self.compile(self.intermediary_process_rules)
+        self._relation_table = self.relation_table(mechanism_terms)
+        TERM_URIS.add_all(r.process for r in self.intermediary_process_rules)
+
+    @staticmethod
+    def rule_conditions(rule: dict):
+        return {
+            "mechanism": rule.get("MECHANISM"),
+            "entity_a_type": rule.get("ENTITY_A_TYPE"),
+            "effect": rule.get("EFFECT"),
+            "direct": rule.get("DIRECT"),
+        }
+
+    def compile(self, rules):
+        entity_types = list(SignorEntityFactory.entity_type_map) + [None]
+        table = {}
+        for rule in rules:
+            for entity_type in [rule.entity_a_type] if rule.entity_a_type else entity_types:
+                for effect in [rule.effect] if rule.effect else self.EFFECT_CLASSES:
+                    for direct in [rule.direct] if rule.direct is not None else [True, False]:
+                        # First matching rule wins
+                        table.setdefault((rule.mechanism, entity_type, effect, direct), rule)
+        return table
+
+    def relation_table(self, mechanism_terms):
+        # (mechanism term, entity class, effect string, direct) -> relation, for every known effect string.
+        # Combinations no rule covers are left out and go through lookup() like anything else not in here.
+        table = {}
+        for term in mechanism_terms:
+            for entity_class, entity_type in self.entity_types.items():
+                for effect, effect_class in self._effect_classes.items():
+                    for direct in [True, False]:
+                        rule = self.find_rule(self._relations, term, entity_type, effect_class, direct)
+                        if rule is not None:
+                            table[(term, entity_class, effect, direct)] = rule.relation
+        return table
+
+    def effect_class(self, effect):
+        if effect in self._effect_classes:
+            return self._effect_classes[effect]
+        # Not in EFFECTS. Go by what it starts with, if that says anything, and let someone know.
+        effect_class = None
+        if effect.startswith("up-regulates"):
+            effect_class = "up-regulates"
+        elif effect.startswith("down-regulates"):
+            effect_class = "down-regulates"
+        self._effect_classes[effect] = effect_class
+        self.unknown_effects.add(effect)
+        if effect_class is None:
+            print(f"Unrecognized SIGNOR effect '{effect}', its connections get no causal relation edge",
+                  file=sys.stderr)
+        else:
+            print(f"Unrecognized SIGNOR effect '{effect}', treating it as {effect_class}", file=sys.stderr)
+        return effect_class
+
+    @staticmethod
+    def find_rule(table, mechanism_term, entity_type, effect_class, direct):
+        key = (entity_type, effect_class, direct)
+        rule = table.get((mechanism_term,) + key)
+        if rule is None:
+            rule = table.get((None,) + key)
+        return rule
+
+    def lookup(self, table, pc):
+        return self.find_rule(table, pc.mechanism.term, self.entity_types.get(type(pc.entity_a)),
+                              self.effect_class(pc.effect), bool(pc.direct))
+
+    def relation(self, pc):
+        relation = self._relation_table.get((pc.mechanism.term, type(pc.entity_a), pc.effect, bool(pc.direct)))
+        if relation is not None:
+            return relation
+        rule = self.lookup(self._relations, pc)
+        if rule is not None:
+            return rule.relation
+
+    def intermediary_process(self, pc) -> IntermediaryProcessRule:
+        return self.lookup(self._intermediary_processes, pc)
+
+
+class ActivityRecord:
+    # Activity (mechanism or regulated activity) of a PathwayConnection
+    # node is the activity's id in a causal_graph.CausalGraph, uri its individual in the model
+    __slots__ = ("name", "uri", "term", "node")
+
+    def __init__(self, name=None, uri=None, term=None):
+        self.name = name
+        self.uri = uri
+        self.term = term
+        self.node = None
+
+    def __eq__(self, other):
+        if isinstance(other, ActivityRecord):
+            return self.name == other.name and self.uri == other.uri and self.term == other.term
+        return False
+
+    def __hash__(self):
+        return hash((self.name, self.uri, self.term))
 
 
 # * Connect causal statements together in networkx graph
@@ -90,6 +294,11 @@ class AnnotatorOrcidMappingSet:
 class PathwayConnection:
     MECHANISM_GO_MAPPING = MechanismToGoMappingSet("metadata/signor_mechanism_go_mapping.yaml")
     ANNOTATOR_ORCID_MAPPING = AnnotatorOrcidMappingSet("metadata/annotator_orcid.tsv")
+    MECHANISM_RULES = MechanismRuleSet("metadata/signor_mechanism_rules.yaml",
+                                       mechanism_terms=MECHANISM_GO_MAPPING.go_ids())
+    __slots__ = ("entity_a", "entity_b", "effect", "direct", "references", "date", "linenum", "mechanism",
+                 "relation", "regulated_activity", "annotator", "entity_a_uri", "enabled_by_stmt_a",
+                 "entity_a_node")
 
     def __init__(self, entity_a: SignorEntity, entity_b: SignorEntity, mechanism, effect, direct: bool,
                  references: list, annotator, relation: OntologyTerm = None, date: str = None, linenum=None):
@@ -104,35 +313,29 @@ class PathwayConnection:
         mechanism_term = "GO:0003674"
         if mechanism:
             mechanism_term = self.MECHANISM_GO_MAPPING.go_id_by_mechanism(mechanism)
-        self.mechanism = {
-            "name": mechanism,
-            "uri": None,
-            "term": mechanism_term
-        }
+        self.mechanism = ActivityRecord(name=mechanism, term=mechanism_term)
         self.relation = relation
         if self.relation is None:
             self.relation = self.determine_relation()
-        self.regulated_activity = {
-            "name": None,
-            "uri": None,
-            "term": None
-        }
+        self.regulated_activity = ActivityRecord()
 
         self.annotator = None
         if annotator:
             self.annotator = self.ANNOTATOR_ORCID_MAPPING.orcid_by_name(annotator)
 
-        self.individuals = {}
+        # Individual declared for entity A in the model. Entities themselves are shared across connections.
+        self.entity_a_uri = None
+        self.entity_a_node = None
         self.enabled_by_stmt_a = None
 
     @staticmethod
-    def parse_line(line: dict, linenum: int=None):
+    def parse_line(line: dict, linenum: int=None, direct: bool=None):
+        # direct if the DIRECT column was already classified, e.g. by acceptable_column_rows()
         entity_a = SignorEntityFactory.determine_entity(entity_id=line["IDA"], entity_name=line["ENTITYA"], entity_type=line["TYPEA"])
         entity_b = SignorEntityFactory.determine_entity(entity_id=line["IDB"], entity_name=line["ENTITYB"], entity_type=line["TYPEB"])
 
-        direct = False
-        if line["DIRECT"] in ["YES", "t"]:
-            direct = True
+        if direct is None:
+            direct = line["DIRECT"] in DIRECT_VALUES
 
         pc = PathwayConnection(
             entity_a=entity_a,
@@ -147,72 +350,46 @@ class PathwayConnection:
         return pc
 
     def determine_relation(self):
-        # If up-regulates (including any variants of this), use RO:0002629 if DIRECT,
-        # and use RO:0002213 if not DIRECT or UNKNOWN
-        relation = None
-        if self.effect.startswith("up-regulates"):
-            if self.mechanism["term"] == "GO:0003674":
-                relation = OntologyTerm.CAUSALLY_UPSTREAM_OF_POSITIVE_EFFECT
-            elif self.direct:
-                relation = OntologyTerm.DIRECTLY_POSITIVELY_REGULATES
-            else:
-                relation = OntologyTerm.POSITIVELY_REGULATES
-        # If down-regulates (including any variants of this), use RO:0002630 if DIRECT,
-        # and use RO:0002212 if not DIRECT or UNKNOWN
-        elif self.effect.startswith("down-regulates"):
-            if self.mechanism["term"] == "GO:0003674":
-                relation = OntologyTerm.CAUSALLY_UPSTREAM_OF_NEGATIVE_EFFECT
-            elif self.direct:
-                relation = OntologyTerm.DIRECTLY_NEGATIVELY_REGULATES
-            else:
-                relation = OntologyTerm.NEGATIVELY_REGULATES
-        # If unknown, use RO:0002211 (regulates)
-        elif self.effect in ["unknown", ""]:
-            if self.mechanism["term"] == "GO:0003674":
-                relation = OntologyTerm.CAUSALLY_UPSTREAM_OF
-            else:
-                relation = OntologyTerm.REGULATES
-
-        return relation
+        # See RELATIONS in metadata/signor_mechanism_rules.yaml, e.g. up-regulates is RO:0002629 if DIRECT and
+        # RO:0002213 if not DIRECT or UNKNOWN
+        return self.MECHANISM_RULES.relation(self)
 
-    def gocam_evidence(self, eco_code):
+    def gocam_evidence(self, eco_code, evidence_cache=None):
+        # Connections with the same code, references, date and annotator share one GoCamEvidence per
+        # evidence_cache (e.g. CausalGraph.evidence_cache)
         date = self.date
         contributors = []
         if date is None:
-            date = str(datetime.date.today())
+            date = today()
+        key = (eco_code, frozenset(self.references), date, self.annotator)
+        if evidence_cache is not None:
+            evidence = evidence_cache.get(key)
+            if evidence is not None:
+                return evidence
         if self.annotator:
             contributors = [self.annotator]
-        return gocamgen.GoCamEvidence(eco_code, ["PMID:" + pmid for pmid in self.references],
-                                 date=date, contributors=contributors)
+        evidence = gocamgen.GoCamEvidence(eco_code, ["PMID:" + pmid for pmid in self.references],
+                                          date=date, contributors=contributors)
+        if evidence_cache is not None:
+            evidence_cache[key] = evidence
+        return evidence
 
     def __str__(self):
-        return f"[UniProtKB:{self.id_a()}] <- enabled_by – [{self.mechanism['term']}] – [{self.relation}]-> [{self.regulated_activity['term']}] – enabled_by-> [UniProtKB:{self.id_b()}]"
+        return f"[UniProtKB:{self.id_a()}] <- enabled_by – [{self.mechanism.term}] – [{self.relation}]-> [{self.regulated_activity.term}] – enabled_by-> [UniProtKB:{self.id_b()}]"
 
     def print(self):
         print(self)
 
-    def declare_a_to_mechanism(self, model: gocamgen.GoCamModel, eco_code):
-        # Declare entity A and mechanism
-        self.declare_a(model)
+    def add_a_to_mechanism(self, graph, eco_code):
+        # Add entity A and its mechanism individual (mechanism -enabled_by-> A) to a causal_graph.CausalGraph
+        self.entity_a_node = self.entity_a.add_to_graph(graph)
         if self.a_is_small_mol():
             # Skip enabled_by stmt for small molecules
-            self.mechanism["uri"] = self.entity_a.uri  # Entity A is_activator
+            self.mechanism.node = self.entity_a_node  # Entity A is_activator
             return
-        self.mechanism["uri"] = model.declare_individual(self.mechanism["term"])
-        # Emit mechanism -enabled_by -> entity_a
-        self.enabled_by_stmt_a = model.writer.emit(self.mechanism["uri"], ENABLED_BY, self.entity_a.uri)
-        evidence = self.gocam_evidence(eco_code)
-        return model.add_axiom(self.enabled_by_stmt_a, evidence=evidence)
-
-    def declare_entities(self, model):
-        self.declare_a(model)
-        self.declare_b(model)
-
-    def declare_a(self, model):
-        self.entity_a.declare(model)
-
-    def declare_b(self, model):
-        self.entity_b.declare(model)
+        self.mechanism.node = graph.add_node(self.mechanism.term)
+        graph.add_edge(self.mechanism.node, ENABLED_BY, self.entity_a_node,
+                       evidence=self.gocam_evidence(eco_code, graph.evidence_cache))
 
     def id_a(self):
         return self.entity_a.id
@@ -261,11 +438,26 @@ class PathwayConnection:
         return self._is_small_mol(self.entity_b)
 
     def clone(self):
-        new_connection = PathwayConnection(self.entity_a, self.entity_b, self.mechanism["name"], self.effect,
-                                           self.direct, self.relation, self.references, self.linenum)
-        new_connection.mechanism = self.mechanism
+        new_connection = PathwayConnection(self.entity_a, self.entity_b, self.mechanism.name, self.effect,
+                                           self.direct, self.references, None, relation=self.relation,
+                                           date=self.date, linenum=self.linenum)
+        new_connection.mechanism = copy(self.mechanism)
+        new_connection.annotator = self.annotator
         return new_connection
 
+    def key(self):
+        # Identity used by PathwayConnectionSet. Mirrors equals() minus the individual URIs, which are only
+        # filled in once the connection is declared in a model.
+        return (
+            _entity_key(self.entity_a),
+            _entity_key(self.entity_b),
+            self.mechanism.name,
+            self.mechanism.term,
+            self.relation,
+            self.regulated_activity.name,
+            self.regulated_activity.term,
+        )
+
     def equals(self, pathway_connection, check_ref=False):
         if self.entity_a == pathway_connection.entity_a and self.entity_b == pathway_connection.entity_b and \
                 self.mechanism == pathway_connection.mechanism and self.relation == pathway_connection.relation \
@@ -279,125 +471,257 @@ class PathwayConnection:
 
     def full_statement_bnode_in_model(self, model):
         # Find all existing URI's for IDA, IDB, mech, and reg. Check if statements exist for these URI combos. Might need SPARQL or further triple querying refinement (e.g. triple annotated with "owl:NamedIndividual")
-        # mechanism["term"] ENABLED_BY self.id_a
-        # regulated_activity["term"] ENABLED_BY self.id_b
-        # mechanism["term"] REGULATES regulated_activity["term"]
+        # mechanism.term ENABLED_BY self.id_a
+        # regulated_activity.term ENABLED_BY self.id_b
+        # mechanism.term REGULATES regulated_activity.term
         graph = model.writer.writer.graph
 
         # a_enables_triples = []
         # for id_a in model.uri_list_for_individual(self.full_id_a()):
-        #     for mech_uri in model.uri_list_for_individual(self.mechanism["term"]):
+        #     for mech_uri in model.uri_list_for_individual(self.mechanism.term):
         #         if (mech_uri, ENABLED_BY, id_a) in graph:
         #             a_enables_triples.append((mech_uri, ENABLED_BY, id_a))
-        a_enables_triples = model.triples_by_ids(self.mechanism["term"], ENABLED_BY, self.full_id_a())
+        a_enables_triples = model.triples_by_ids(self.mechanism.term, ENABLED_BY, self.full_id_a())
 
         # b_enables_triples = []
         # for id_b in model.uri_list_for_individual(self.full_id_b()):
-        #     for reg_act in model.uri_list_for_individual(self.regulated_activity["term"]):
+        #     for reg_act in model.uri_list_for_individual(self.regulated_activity.term):
         #         if (reg_act, ENABLED_BY, id_b) in graph:
         #             b_enables_triples.append((reg_act, ENABLED_BY, id_b))
-        b_enables_triples = model.triples_by_ids(self.regulated_activity["term"], ENABLED_BY, self.full_id_b())
+        b_enables_triples = model.triples_by_ids(self.regulated_activity.term, ENABLED_BY, self.full_id_b())
 
         for a_triple in a_enables_triples:
             for b_triple in b_enables_triples:
-                candidate_reg_triple = (a_triple[0], URIRef(expand_uri(self.relation)), b_triple[0])
+                candidate_reg_triple = (a_triple[0], self.relation.uri, b_triple[0])
                 if candidate_reg_triple in graph:
                     return candidate_reg_triple
 
 
+@functools.lru_cache(maxsize=1)
+def today():
+    # Evidence date for undated SIGNOR rows. Fixed for the whole run.
+    return str(datetime.date.today())
+
+
+def _entity_key(entity: SignorEntity):
+    if entity is None:
+        return None
+    return entity.id, entity.name
+
+
 def upper_first(iterator):
     return itertools.chain([next(iterator).upper()], iterator)
 
 
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_pathway_file(filename):
+    # SIGNOR TSV from a path or "-" for stdin, gzip-compressed or not
+    if filename == "-":
+        stdin = sys.stdin.buffer
+        if stdin.peek(2)[:2] == GZIP_MAGIC:
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=stdin))
+        return contextlib.nullcontext(sys.stdin)
+    with open(filename, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+    if is_gzip:
+        return gzip.open(filename, "rt")
+    return open(filename, "r")
+
+
+def read_rows(lines):
+    # Lazily read TSV lines into dicts. Header case varies between SIGNOR downloads, so normalize it.
+    return csv.DictReader(upper_first(iter(lines)), delimiter="\t")
+
+
+# Rows read into columns at a time by acceptable_column_rows()
+COLUMN_BLOCK_ROWS = 1000
+DIRECT_VALUES = frozenset(["YES", "t"])
+
+
+def _column_mask(column, accept):
+    # accept() is only called once per distinct value in the column
+    verdicts = {value: accept(value) for value in set(column)}
+    return tuple(map(verdicts.__getitem__, column))
+
+
+def acceptable_column_rows(lines, counts=None, column_filters=None, block_rows=COLUMN_BLOCK_ROWS):
+    # Rows of a SIGNOR TSV the converter can handle (known entity types, a mapped mechanism, not "form complex"), as
+    # csv.DictReader dicts. Rows are split into lists and the acceptability checks run over whole columns of a block
+    # of rows, once per distinct value. Only the rows that pass get turned into dicts, so phenotypes, "form complex"
+    # rows and unmapped mechanisms cost next to nothing.
+    # column_filters: extra {column: accepted values} checks, e.g. {"TAX_ID": {"9606"}}
+    # Yields (linenum, row, direct), direct being the DIRECT column already classified.
+    acceptable_mechanisms = PathwayConnection.MECHANISM_GO_MAPPING.acceptable_mechanisms()
+    acceptable_types = frozenset(SignorEntityFactory.entity_type_map)
+    reader = csv.reader(lines, delimiter="\t")
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [h.upper() for h in header]
+    width = len(header)
+    index = {h: i for i, h in enumerate(header)}
+    checks = [("TYPEA", acceptable_types.__contains__),
+              ("TYPEB", acceptable_types.__contains__),
+              ("MECHANISM", acceptable_mechanisms.__contains__),
+              ("EFFECT", lambda effect: effect != "form complex")]
+    if column_filters:
+        checks.extend((column, frozenset(values).__contains__) for column, values in column_filters.items())
+    linenum = 0
+    while True:
+        # Blank lines are skipped and short rows padded, same as csv.DictReader. Extra cells of long rows end up in a
+        # list under the None key, DictReader's default restkey.
+        block = []
+        for row in itertools.islice(reader, block_rows):
+            if not row:
+                continue
+            if len(row) < width:
+                row = row + [None] * (width - len(row))
+            block.append(row)
+        if not block:
+            break
+        masks = [_column_mask(list(map(itemgetter(index[column]), block)), accept) for column, accept in checks]
+        survivors = list(itertools.compress(range(len(block)), map(all, zip(*masks))))
+        direct_column = _column_mask(list(map(itemgetter(index["DIRECT"]), block)), DIRECT_VALUES.__contains__)
+        if counts is not None:
+            counts["total"] += len(block)
+            counts["converted"] += len(survivors)
+        for i in survivors:
+            row = block[i]
+            record = dict(zip(header, row))
+            if len(row) > width:
+                record[None] = row[width:]
+            yield linenum + i + 1, record, direct_column[i]
+        linenum += len(block)
+
+
 class PathwayConnectionSet:
+    MECHANISM_PRECEDENCE = MechanismPrecedenceRuleSet("metadata/signor_mechanism_precedence.yaml")
+
     def __init__(self):
-        self.connections: List[PathwayConnection] = []
+        # Keyed by PathwayConnection.key(). Dicts keep insertion order so this is also the ordered connection list.
+        self._connections: Dict[tuple, PathwayConnection] = {}
+        # Adjacency indexes over the same connections, keyed by entity A id and by (entity A id, entity B id)
+        self._by_id_a: Dict[str, Dict[tuple, PathwayConnection]] = {}
+        self._by_id_a_and_id_b: Dict[tuple, Dict[tuple, PathwayConnection]] = {}
+
+    @property
+    def connections(self) -> List[PathwayConnection]:
+        return list(self._connections.values())
+
+    @connections.setter
+    def connections(self, connections: List[PathwayConnection]):
+        self._connections = {}
+        self._by_id_a = {}
+        self._by_id_a_and_id_b = {}
+        for pc in connections:
+            if pc.key() not in self._connections:
+                self._index(pc)
+
+    def _index(self, pathway_connection: PathwayConnection):
+        key = pathway_connection.key()
+        self._connections[key] = pathway_connection
+        self._by_id_a.setdefault(pathway_connection.id_a(), {})[key] = pathway_connection
+        pair = (pathway_connection.id_a(), pathway_connection.id_b())
+        self._by_id_a_and_id_b.setdefault(pair, {})[key] = pathway_connection
+
+    def _unindex(self, pathway_connection: PathwayConnection):
+        key = pathway_connection.key()
+        del self._connections[key]
+        id_a = pathway_connection.id_a()
+        del self._by_id_a[id_a][key]
+        if not self._by_id_a[id_a]:
+            del self._by_id_a[id_a]
+        pair = (id_a, pathway_connection.id_b())
+        del self._by_id_a_and_id_b[pair][key]
+        if not self._by_id_a_and_id_b[pair]:
+            del self._by_id_a_and_id_b[pair]
+
+    def __len__(self):
+        return len(self._connections)
+
+    def __iter__(self):
+        return iter(self.connections)
 
     @staticmethod
     def parse_file(filename):
+        # filename can also be an open file or any other iterable of TSV lines
         pc_set = PathwayConnectionSet()
 
-        linenum = 0
         if filename:
-            with open(filename, "r") as f:
-                data = list(csv.DictReader(upper_first(f), delimiter="\t"))
-                total_stmts = len(data)
-                converted_count = 0
-                acceptable_mechanisms = PathwayConnection.MECHANISM_GO_MAPPING.acceptable_mechanisms()
-                for line in data:
-                    linenum += 1
-
-                    acceptable_types = SignorEntityFactory.entity_type_map.keys()
-                    if line["TYPEA"] not in acceptable_types or \
-                       line["TYPEB"] not in acceptable_types or \
-                       line["MECHANISM"] not in acceptable_mechanisms or \
-                       line["EFFECT"] == "form complex":
-                        continue
-
-                    pc = PathwayConnection.parse_line(line, linenum=linenum)
-                    pc_set.add(pc)
-                    converted_count += 1
-                print("Total statement count:", total_stmts)
-                print("Converted statement count", converted_count)
+            if isinstance(filename, (str, os.PathLike)):
+                with open_pathway_file(filename) as f:
+                    pc_set.add_lines(f)
+            else:
+                pc_set.add_lines(filename)
 
         return pc_set
 
+    @staticmethod
+    def iter_connections(lines, counts=None):
+        # Rows are read, filtered and converted one at a time so only the PathwayConnections kept by the
+        # consumer stay in memory
+        for linenum, line, direct in acceptable_column_rows(lines, counts=counts):
+            yield PathwayConnection.parse_line(line, linenum=linenum, direct=direct)
+
+    def add_lines(self, lines):
+        counts = {"total": 0, "converted": 0}
+        for pc in self.iter_connections(lines, counts=counts):
+            self.add(pc)
+        print("Total statement count:", counts["total"])
+        print("Converted statement count", counts["converted"])
+
     def add(self, pathway_connection: PathwayConnection):
         existing_connection = self.find(pathway_connection)
         if existing_connection:
             # Causal statement already exists so just add reference
             existing_connection.references = set(existing_connection.references) | set(pathway_connection.references)
         else:
-            self.connections.append(pathway_connection)
+            self._index(pathway_connection)
 
     def contains(self, pathway_connection: PathwayConnection, check_ref=False):
-        for connection in self.connections:
-            if connection.equals(pathway_connection, check_ref=check_ref):
-                return True
-        return False
+        return self.find(pathway_connection, check_ref=check_ref) is not None
 
     def find(self, pathway_connection: PathwayConnection, check_ref=False):
-        for connection in self.connections:
-            if connection.equals(pathway_connection, check_ref=check_ref):
-                return connection
+        connection = self._connections.get(pathway_connection.key())
+        if connection is not None and connection.equals(pathway_connection, check_ref=check_ref):
+            return connection
 
     def find_by_id_a(self, id) -> List[PathwayConnection]:
-        pcs = []
-        for pc in self.connections:
-            if pc.id_a() == id:
-                pcs.append(pc)
-        return pcs
+        return list(self._by_id_a.get(id, {}).values())
+
+    def find_by_id_a_and_id_b(self, id_a, id_b) -> List[PathwayConnection]:
+        return list(self._by_id_a_and_id_b.get((id_a, id_b), {}).values())
+
+    def id_pairs(self):
+        return list(self._by_id_a_and_id_b.keys())
 
     def find_other_regulated_activity(self, id_b):
         regulated_pcs = self.find_by_id_a(id_b)
         filtered_reg_pcs = []
         for pc in regulated_pcs:
-            if pc.mechanism["term"] != "GO:0003674":
+            if pc.mechanism.term != "GO:0003674":
                 filtered_reg_pcs.append(pc)
         if len(filtered_reg_pcs) > 0:
             return filtered_reg_pcs[0]
 
     def find_all_by_id_a_and_id_b(self, pathway_connection):
         found_connections = PathwayConnectionSet()
-        for pc in self.connections:
-            if pc.id_a() == pathway_connection.id_a() and pc.id_b() == pathway_connection.id_b():
-                found_connections.add(pc)
+        for pc in self.find_by_id_a_and_id_b(pathway_connection.id_a(), pathway_connection.id_b()):
+            found_connections.add(pc)
         return found_connections
 
     def find_by_mech_term(self, term):
         for pc in self.connections:
-            if pc.mechanism["term"] == term:
+            if pc.mechanism.term == term:
                 return pc
 
     def remove_connection(self, pathway_connection):
-        new_connections = []
-        for pc in self.connections:
-            if not pc.equals(pathway_connection):
-                new_connections.append(pc)
-        self.connections = new_connections
+        existing_connection = self.find(pathway_connection)
+        if existing_connection is not None:
+            self._unindex(existing_connection)
 
     def remove_list(self, pc_list):
-        new_connection_list = self.connections
         for dead_pc in pc_list:
-            new_connection_list = [pc for pc in new_connection_list if not pc.equals(dead_pc)]
-        self.connections = new_connection_list
+            self.remove_connection(dead_pc)
@@ -1,27 +1,42 @@
-from ontobio.rdfgen.gocamgen import gocamgen
 from ontobio.vocabulary.relations import OboRO
-from rdflib.term import URIRef
-from rdflib.namespace import Namespace, OWL
-from prefixcommons.curie_util import expand_uri
-from pathway_connections import PathwayConnectionSet
-from entity_models import SignorProtein, SignorMicroRNA, SignorSmallMolecule
-from util import OntologyTerm
+from rdflib.namespace import OWL
+from pathway_connections import PathwayConnection, PathwayConnectionSet
+from gocam_model import SignorGoCamModel
+from causal_graph import CausalGraph
+from metrics import ConversionMetrics, cprofile_to
+from triple_stream import STREAM_FORMATS, open_triple_stream, output_format
+from entity_factories import SignorEntityFactory
+from util import OntologyTerm, TERM_URIS
 import argparse
-import datetime
+import contextlib
+import time
 
 ro = OboRO()
-ENABLED_BY = URIRef(expand_uri(ro.enabled_by))
-HAS_INPUT = URIRef(expand_uri(OntologyTerm.HAS_INPUT.value))
-HAS_OUTPUT = URIRef(expand_uri(OntologyTerm.HAS_OUTPUT.value))
+ENABLED_BY = TERM_URIS.add(ro.enabled_by)
+HAS_INPUT = OntologyTerm.HAS_INPUT.uri
+HAS_OUTPUT = OntologyTerm.HAS_OUTPUT.uri
 EXP_ECO_CODE = "ECO:0000269"
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-f', "--filename", type=str, required=True,
-                    help="Input filename of SIGNOR pathway data")
+                    help="Input filename of SIGNOR pathway data. Can be gzipped. Use '-' to read from stdin")
 parser.add_argument('-t', "--model_title", nargs='+',
                     help="Model title. Defaults to --outfile value.")
 parser.add_argument('-o', "--outfile", type=str, required=True,
-                    help="Output filename of generated model")
+                    help="Output filename of generated model. Ending in .nt or .nq (optionally .gz) streams "
+                         "N-Triples/N-Quads out as the model is generated instead of writing Turtle")
+parser.add_argument("--offline", action="store_true",
+                    help="Fail instead of downloading missing SIGNOR complex data")
+parser.add_argument("--complex_per_statement", action="store_true",
+                    help="Declare a separate complex individual for each statement instead of one per complex")
+parser.add_argument("--profile", action="store_true",
+                    help="Print time spent in each conversion phase and counts of declarations, axioms and lookups")
+parser.add_argument("--metrics_json", "--metrics-json", type=str,
+                    help="Write the --profile timings and counts to this JSON file")
+parser.add_argument("--cprofile", type=str,
+                    help="Run the conversion under cProfile and write the stats to this file")
+parser.add_argument("--tracemalloc", action="store_true",
+                    help="Also record peak memory of each phase with tracemalloc (slows conversion down)")
 
 
 def model_contains_statement(model, subject_uri, rel, object_id):
@@ -54,51 +69,88 @@ def test_label_finding(model):
         axiom_counter += 1
 
 
-def pathway_connection_filter_protein_binding(p_connections):
-    # Toss out connections according to precedence rules:
+def pathway_connection_filter_protein_binding(p_connections, precedence_rules=None):
+    # Toss out connections according to precedence rules (metadata/signor_mechanism_precedence.yaml), e.g.
     # protein kinase activity should be chosen over protein binding
     # This should be separate from/before any OWL individuals are declared
-    for pc in p_connections.connections:
-        # Get list of all pcs with pc.id_a and pc.id_b
-        # If len of list is > 1
-        #   Look for protein kinase activity (GO:0004672), delete others if remaining are all protein binding (GO:0005515)
-        pc_list = p_connections.find_all_by_id_a_and_id_b(pc)
-        if len(pc_list.connections) > 1:
-            the_good_one = pc_list.find_by_mech_term("GO:0004672")
-            the_bad_one = pc_list.find_by_mech_term("GO:0005515")
-            if the_good_one is not None and the_bad_one is not None:
-                # pc_list.connections.remove(the_good_one)
-                # p_connections.remove_list(pc_list.connections)
-                p_connections.remove_connection(the_bad_one)
+    if precedence_rules is None:
+        precedence_rules = PathwayConnectionSet.MECHANISM_PRECEDENCE
+    dead_pcs = []
+    # One pass over the (id_a, id_b) buckets; removal happens after so nothing is mutated mid-iteration
+    for id_a, id_b in p_connections.id_pairs():
+        pc_list = p_connections.find_by_id_a_and_id_b(id_a, id_b)
+        if len(pc_list) > 1:
+            dead_pcs.extend(precedence_rules.connections_to_drop(pc_list))
+    p_connections.remove_list(dead_pcs)
     return p_connections
 
 
-def generate_model(filename, title):
-    model = gocamgen.GoCamModel(title)
-
-    p_connections = PathwayConnectionSet.parse_file(filename)
-    linenum = 1
+def generate_model(filename, title, complex_per_statement=False, store=None, metrics=None):
+    # store e.g. a TripleStreamStore to write triples out as they're generated
+    # metrics a metrics.ConversionMetrics to record phase timings and counts in, also kept as model.metrics
+    if metrics is None:
+        metrics = ConversionMetrics()
+    with metrics.phase("parse"):
+        p_connections = PathwayConnectionSet.parse_file(filename)
 
-    total_pcs = len(p_connections.connections)
+    total_pcs = len(p_connections)
     print(total_pcs, "initial pathway_connections")
+    metrics.count("connections_parsed", total_pcs)
+
+    with metrics.phase("filter"):
+        p_connections = pathway_connection_filter_protein_binding(p_connections)
+    return model_from_connections(p_connections, title, complex_per_statement=complex_per_statement, store=store,
+                                  metrics=metrics)
+
+
+def model_from_connections(p_connections, title, complex_per_statement=False, store=None, metrics=None):
+    # Build the model for already parsed and filtered connections
+    if metrics is None:
+        metrics = ConversionMetrics()
+    metrics.count("connections_converted", len(p_connections))
+    model = SignorGoCamModel(title, store=store, metrics=metrics)
+    mechanism_rules = PathwayConnection.MECHANISM_RULES
 
-    p_connections = pathway_connection_filter_protein_binding(p_connections)
+    # Wire everything up as integer nodes and edges first so nothing has to be queried back out of rdflib,
+    # then write the RDF in one pass
+    graph = CausalGraph(complex_per_statement=complex_per_statement, metrics=metrics)
 
     # fill in regulated activities
-    for pc in p_connections.connections:
-        # Setup
-        pc.declare_a_to_mechanism(model, EXP_ECO_CODE)
+    with metrics.phase("declare_a_to_mechanism"):
+        for pc in p_connections.connections:
+            # Setup
+            pc.add_a_to_mechanism(graph, EXP_ECO_CODE)
 
     # Now that the a's are declared, go check on the b's.
+    with metrics.phase("downstream_wiring"):
+        wire_downstream(p_connections, graph, mechanism_rules, metrics)
+
+    with metrics.phase("emit_rdf"):
+        uris = graph.emit(model)
+    metrics.count("causal_graph_nodes", len(graph))
+    metrics.count("causal_graph_edges", graph.edge_count())
     for pc in p_connections.connections:
-        # Look for triples "anything" -enabled_by-> entity B
+        pc.entity_a_uri = uris[pc.entity_a_node]
+        pc.mechanism.uri = uris[pc.mechanism.node]
+
+    print(len(p_connections), "pathway_connections at finish")
+
+    return model
+
+
+def wire_downstream(p_connections, graph, mechanism_rules, metrics):
+    # Time spent on intermediary BPs is added up separately (it's also part of downstream_wiring)
+    intermediary_seconds = 0.0
+    for pc in p_connections.connections:
+        # Look for triples "anything" -enabled_by-> entity B. Indexed lookup keeps this loop linear in connections.
         entity_b_pcs = p_connections.find_by_id_a(pc.id_b())
+        metrics.count("downstream_lookups")
         # If doesn't exist, declare entity B and "anything" becomes root MF, then emit enabled_by
         # TODO
-        # Emit reg relation from mechanism URI to entity B triples' activities
-        mechanism_uri = pc.mechanism["uri"]
+        # Emit reg relation from mechanism node to entity B triples' activities
+        mechanism_node = pc.mechanism.node
         regulatory_relation = pc.relation
-        evidence = pc.gocam_evidence(EXP_ECO_CODE)
+        evidence = pc.gocam_evidence(EXP_ECO_CODE, graph.evidence_cache)
         if len(entity_b_pcs) == 0:
             # BPC was likely filtered out due to BPC.entity B not being acceptable type (e.g. phenotype)
             # Declare pc.entity B? A and B should be valid by this point
@@ -110,76 +162,43 @@ def generate_model(filename, title):
             participant_relation = HAS_INPUT
             is_small_mol_catalysis = False
             # catalytic activity
-            if pc.mechanism["term"] == "GO:0003824" and pc.b_is_small_mol():
+            if pc.mechanism.term == "GO:0003824" and pc.b_is_small_mol():
                 is_small_mol_catalysis = True
                 if pc.effect.startswith("up-regulates"):
                     participant_relation = HAS_OUTPUT
             if not pc.a_is_small_mol():
                 # mechanism -has_input/output-> entity_b
-                has_input_triple = (mechanism_uri, participant_relation, bpc.entity_a.uri)
-                if len(model.triples_by_ids(*has_input_triple)) == 0:
-                    model.writer.emit(*has_input_triple)
-                has_input_axiom = model.find_or_create_axiom(*has_input_triple)
-                model.add_evidence(has_input_axiom, evidence=evidence)
+                graph.add_edge(mechanism_node, participant_relation, bpc.entity_a_node, evidence=evidence)
                 if is_small_mol_catalysis:
                     # Skip adding causal relation
                     continue
-
-            # Add intermediary biological process for these regulatory mechanisms
-            intermediary_bp = None
-            intermediary_relation = None
-            downstream_relation = None
-            # ubiquitin protein ligase activity
-            if pc.mechanism["term"] == "GO:0061630" and pc.effect.startswith("down-regulates"):
-                intermediary_bp = "GO:0043161"  # proteasome-mediated ubiquitin-dependent protein catabolic process
-                intermediary_relation = OntologyTerm.POSITIVELY_REGULATES
-                downstream_relation = OntologyTerm.NEGATIVELY_REGULATES
-            # transcription regulator activity
-            if pc.mechanism["term"] == "GO:0140110":
-                intermediary_bp = "GO:0009299"  # mRNA transcription
-                if pc.effect.startswith("down-regulates"):
-                    intermediary_relation = OntologyTerm.NEGATIVELY_REGULATES
-                else:
-                    intermediary_relation = OntologyTerm.POSITIVELY_REGULATES
-                downstream_relation = OntologyTerm.POSITIVELY_REGULATES
-            # mRNA 3'-UTR binding
-            if pc.mechanism["term"] == "GO:0003730":
-                if isinstance(pc.entity_a, SignorMicroRNA) and pc.effect.startswith("down-regulates"):
-                    intermediary_bp = "GO:0035195"  # gene silencing by miRNA
-                    intermediary_relation = OntologyTerm.POSITIVELY_REGULATES
-                    downstream_relation = OntologyTerm.NEGATIVELY_REGULATES
-                elif isinstance(pc.entity_a, SignorProtein):
-                    intermediary_bp = "GO:0000956"  # nuclear-transcribed mRNA catabolic process
-                    if pc.effect.startswith("down-regulates"):
-                        intermediary_relation = OntologyTerm.NEGATIVELY_REGULATES
-                    else:
-                        intermediary_relation = OntologyTerm.POSITIVELY_REGULATES
-                    downstream_relation = OntologyTerm.NEGATIVELY_REGULATES
-            if intermediary_bp:
+            if regulatory_relation is None:
+                # Effect the rules can't place (reported once by MechanismRuleSet.effect_class), so there's no
+                # causal relation to draw. The connection keeps its enabled_by and has_input edges.
+                metrics.count("regulations_without_relation")
+                continue
+
+            # Add intermediary biological process for these regulatory mechanisms, e.g. ubiquitin protein ligase
+            # activity -> proteasome-mediated ubiquitin-dependent protein catabolic process.
+            # See INTERMEDIARY_PROCESSES in metadata/signor_mechanism_rules.yaml
+            intermediary_rule = mechanism_rules.intermediary_process(pc)
+            if intermediary_rule:
+                intermediary_start = time.perf_counter()
+                metrics.count("intermediary_bp")
+                intermediary_relation = intermediary_rule.upstream_relation
+                downstream_relation = intermediary_rule.downstream_relation
                 # Extend the statement a bit
-                intermediary_bp_uri = model.declare_individual(intermediary_bp)
+                intermediary_bp_node = graph.add_node(intermediary_rule.process)
                 # mechanism -has_input-> entity_b
-                has_input_triple = (intermediary_bp_uri, HAS_INPUT, bpc.entity_a.uri)
-                model.writer.emit(*has_input_triple)
-                model.add_axiom(has_input_triple, evidence=evidence)
+                graph.add_edge(intermediary_bp_node, HAS_INPUT, bpc.entity_a_node, evidence=evidence)
                 # downstream relation (intermediary_bp -?-> regulated_activity) is static for some of these
-                intermediary_triple = (mechanism_uri, URIRef(expand_uri(intermediary_relation.value)), intermediary_bp_uri)
-                model.writer.emit(*intermediary_triple)
-                model.add_axiom(intermediary_triple, evidence=evidence)
-                mechanism_uri, regulatory_relation = intermediary_bp_uri, downstream_relation
+                graph.add_edge(mechanism_node, intermediary_relation.uri, intermediary_bp_node, evidence=evidence)
+                mechanism_node, regulatory_relation = intermediary_bp_node, downstream_relation
+                intermediary_seconds += time.perf_counter() - intermediary_start
 
             # mechanism -regulates-> regulated_activity OR mechanism -regulates-> intermediary BP -regulates-> regulated_activity
-            regulated_activity_uri = bpc.mechanism["uri"]
-            regulation_triple = (mechanism_uri, URIRef(expand_uri(regulatory_relation.value)), regulated_activity_uri)
-            model.writer.emit(*regulation_triple)
-            model.add_axiom(regulation_triple, evidence=evidence)
-
-    print(len(p_connections.connections), "pathway_connections at finish")
-
-    grouped = map(lambda x:x.id_a, p_connections.connections)
-    print(grouped)
-
-    return model
+            graph.add_edge(mechanism_node, regulatory_relation.uri, bpc.mechanism.node, evidence=evidence)
+    metrics.add_seconds("intermediary_bp", intermediary_seconds)
     
 
 def main():
@@ -193,13 +212,33 @@ def main():
 
     args = parser.parse_args()
 
+    if args.offline:
+        SignorEntityFactory.offline = True
+
     if args.model_title:
         model_title = " ".join(args.model_title)
     else:
         model_title = args.outfile
     
-    model = generate_model(args.filename, model_title)
-    model.write(args.outfile)
+    metrics = ConversionMetrics(trace_memory=args.tracemalloc)
+    with contextlib.ExitStack() as stack:
+        if args.cprofile:
+            stack.enter_context(cprofile_to(args.cprofile))
+        if output_format(args.outfile) in STREAM_FORMATS:
+            # Serialization happens during emit_rdf
+            with open_triple_stream(args.outfile) as store:
+                generate_model(args.filename, model_title, complex_per_statement=args.complex_per_statement,
+                               store=store, metrics=metrics)
+        else:
+            model = generate_model(args.filename, model_title, complex_per_statement=args.complex_per_statement,
+                                   metrics=metrics)
+            with metrics.phase("serialize"):
+                model.write(args.outfile)
+
+    if args.profile:
+        print(metrics.report())
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,18 +1,115 @@
 import unittest
+from unittest import mock
 import yaml
 import csv
-from rdflib import Graph
+import collections
+import contextlib
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from rdflib import BNode, Dataset, Graph, URIRef
+from rdflib.compare import to_canonical_graph
+from rdflib.namespace import DC
 from rdflib.plugins.sparql import prepareQuery
 from gocamgen.gocamgen import GoCamModel
-from pathway_connections import MechanismToGoMappingSet, PathwayConnectionSet
+from pathway_connections import ENABLED_BY, AnnotatorOrcidMappingSet, MechanismRuleSet, MechanismToGoMappingSet, PathwayConnection, \
+    PathwayConnectionSet, acceptable_column_rows, read_rows
 from pathway_importer import generate_model, pathway_connection_filter_protein_binding
-from util import OntologyTerm
+from download import MirrorManifest, SignorDownloader, pooled_session
+from benchmark import SyntheticSignorPathway, time_phases, scaling_exponents
+from whole_database import PathwayRelationMap, MemoryBudget, MemoryBudgetExceeded, \
+    SignorRelationTable, convert_pathways_from_database, convert_whole_database
+from generate_all_models import CONVERTER_SOURCES, METADATA_FILES, convert_all, convert_dataset, pathway_title
+from entity_factories import SignorComplexFactory, SignorEntityFactory
+from entity_models import SignorMicroRNA, SignorProtein
+from gocam_model import SignorGoCamModel
+from causal_graph import CausalGraph
+from metrics import ConversionMetrics
+from triple_stream import TripleStreamStore, output_format
+from util import OntologyTerm, TERM_URIS
 
 M_FILE = "metadata/signor_mechanism_go_mapping.yaml"
+O_FILE = "metadata/annotator_orcid.tsv"
+MODEL_BASE = "http://model.geneontology.org"
+
+
+def acceptable_rows(rows, counts=None):
+    # Row by row reference for acceptable_column_rows(), on csv.DictReader rows
+    acceptable_mechanisms = PathwayConnection.MECHANISM_GO_MAPPING.acceptable_mechanisms()
+    acceptable_types = frozenset(SignorEntityFactory.entity_type_map)
+    linenum = 0
+    for line in rows:
+        linenum += 1
+        if counts is not None:
+            counts["total"] += 1
+        if line["TYPEA"] not in acceptable_types or \
+           line["TYPEB"] not in acceptable_types or \
+           line["MECHANISM"] not in acceptable_mechanisms or \
+           line["EFFECT"] == "form complex":
+            continue
+        if counts is not None:
+            counts["converted"] += 1
+        yield linenum, line
+
+
+class StubSignorHandler(BaseHTTPRequestHandler):
+    # Stand-in for the SIGNOR download endpoints, serving the test pathway files
+    PATHWAYS = ["SIGNOR-AC", "SIGNOR-IL1R"]
+    failures_left = {"SIGNOR-IL1R": 1}
+
+    def send_content(self, content: bytes, status=200):
+        etag = '"' + hashlib.sha256(content).hexdigest() + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, content = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if "description" in query:
+            rows = ["pathway_id\tpathway_name"] + [f"{p}\tTest pathway" for p in self.PATHWAYS]
+            self.send_content("\n".join(rows).encode("utf-8"))
+        elif query.get("pathway", [""])[0] in self.PATHWAYS:
+            pathway_id = query["pathway"][0]
+            if self.failures_left.get(pathway_id, 0) > 0:
+                self.failures_left[pathway_id] -= 1
+                self.send_content(b"", status=503)
+                return
+            with open(f"resources/test/{pathway_id}.tsv", "rb") as pf:
+                self.send_content(pf.read())
+        else:
+            self.send_content(b"", status=404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_content(b"SIGNOR ID;COMPLEX NAME;LIST OF ENTITIES\nSIGNOR-C3;mTORC1;P42345, Q8N122\n")
+
+    def log_message(self, format, *args):
+        pass
 
 
 class TestSignor2Gocam(unittest.TestCase):
 
+    @staticmethod
+    def canonical_triples(graph):
+        # Model and individual IRIs are random per run, so turn them into blank nodes and canonicalize: two
+        # conversions of the same input then come out as exactly the same set of triples
+        normalized = Graph()
+        for triple in graph:
+            normalized.add(tuple(BNode(str(t)) if isinstance(t, URIRef) and t.startswith(MODEL_BASE) else t
+                                 for t in triple))
+        return set(to_canonical_graph(normalized))
+
     def test_mechanism_map_loading(self):
         with open(M_FILE) as mf:
             mappings = yaml.safe_load(mf)
@@ -22,6 +119,15 @@ class TestSignor2Gocam(unittest.TestCase):
         mapping_set = MechanismToGoMappingSet(M_FILE)
         go_term = mapping_set.go_id_by_mechanism("catalytic activity")
         self.assertEqual(go_term, "GO:0003824")
+        # Mechanisms without a GO_ID fall back on root MF and aren't acceptable
+        self.assertEqual(mapping_set.go_id_by_mechanism("stabilization"), "GO:0003674")
+        self.assertNotIn("stabilization", mapping_set.acceptable_mechanisms())
+        self.assertIn("", mapping_set.acceptable_mechanisms())
+
+    def test_annotator_orcid_mapping_set(self):
+        mapping_set = AnnotatorOrcidMappingSet(O_FILE)
+        self.assertEqual(mapping_set.orcid_by_name("lperfetto"), "http://orcid.org/0000-0003-4392-8725")
+        self.assertIsNone(mapping_set.orcid_by_name("not an annotator"))
 
     @staticmethod
     def mod_prefix_entity(entity_id):
@@ -35,7 +141,8 @@ class TestSignor2Gocam(unittest.TestCase):
             "RO": "http://purl.obolibrary.org/obo/RO_",
             "UniProtKB": "http://identifiers.org/uniprot/",
             "GO": "http://purl.obolibrary.org/obo/GO_",
-            "CHEBI": "http://purl.obolibrary.org/obo/CHEBI_"
+            "CHEBI": "http://purl.obolibrary.org/obo/CHEBI_",
+            "ECO": "http://purl.obolibrary.org/obo/ECO_"
         }
         graph = model.writer.writer.graph
         response = graph.query(prepareQuery(query, initNs=prefix_context))
@@ -228,6 +335,275 @@ class TestSignor2Gocam(unittest.TestCase):
         p_connections = pathway_connection_filter_protein_binding(p_connections)
         self.assertEqual(1, 1)
 
+    def test_parse_file_streams(self):
+        stmt_file = "resources/test/SIGNOR-AC.tsv"
+        p_connections = PathwayConnectionSet.parse_file(stmt_file)
+        with open(stmt_file, "rb") as sf, tempfile.TemporaryDirectory() as tmp_dir:
+            gz_file = os.path.join(tmp_dir, "SIGNOR-AC.tsv.gz")
+            with gzip.open(gz_file, "wb") as gz:
+                gz.write(sf.read())
+            gz_connections = PathwayConnectionSet.parse_file(gz_file)
+        with open(stmt_file) as sf:
+            line_connections = PathwayConnectionSet.parse_file(list(sf))
+        self.assertGreater(len(p_connections), 0)
+        self.assertEqual([pc.key() for pc in gz_connections], [pc.key() for pc in p_connections])
+        self.assertEqual([pc.key() for pc in line_connections], [pc.key() for pc in p_connections])
+
+    def test_columnar_rows_match_row_filter(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic_file = SyntheticSignorPathway(seed=3).write(os.path.join(tmp_dir, "synthetic.tsv"), 500)
+            for stmt_file in ["resources/test/SIGNOR-LBC.tsv", "resources/test/SIGNOR-smallmol.tsv", synthetic_file]:
+                with open(stmt_file) as sf:
+                    lines = list(sf)
+                # Blank line in the middle, then a row with extra cells and a truncated row at the end
+                lines.insert(3, "\n")
+                lines.append(lines[2].rstrip("\n") + "\textra\tcells\n")
+                lines.append(lines[2].split("\t", 12)[0] + "\n")
+                counts = {"total": 0, "converted": 0}
+                expected = list(acceptable_rows(read_rows(lines), counts=counts))
+                column_counts = {"total": 0, "converted": 0}
+                # Small blocks so rows straddle block boundaries
+                columnar = list(acceptable_column_rows(lines, counts=column_counts, block_rows=7))
+                self.assertEqual([(linenum, row) for linenum, row, direct in columnar], expected)
+                self.assertEqual([direct for linenum, row, direct in columnar],
+                                 [row["DIRECT"] in ["YES", "t"] for linenum, row in expected])
+                self.assertIn(["extra", "cells"], [row.get(None) for linenum, row in expected])
+                self.assertEqual(column_counts, counts)
+                self.assertLess(counts["converted"], counts["total"])
+
+        with open("resources/test/SIGNOR-LBC.tsv") as sf:
+            filtered = list(acceptable_column_rows(sf, column_filters={"SIGNOR_ID": ["SIGNOR-236745"]}))
+        self.assertEqual([row["SIGNOR_ID"] for linenum, row, direct in filtered], ["SIGNOR-236745"])
+
+    def test_mechanism_precedence_drops_protein_binding(self):
+        pc_set = PathwayConnectionSet()
+        kinase = PathwayConnection(SignorProtein("P49841", "GSK3B"), SignorProtein("P17676", "CEBPB"),
+                                   mechanism="phosphorylation", effect="up-regulates", direct=True,
+                                   references=["111"], annotator=None)
+        binding = PathwayConnection(SignorProtein("P49841", "GSK3B"), SignorProtein("P17676", "CEBPB"),
+                                    mechanism="", effect="up-regulates", direct=True,
+                                    references=["222"], annotator=None)
+        binding.mechanism.term = "GO:0005515"
+        lone_binding = PathwayConnection(SignorProtein("P49841", "GSK3B"), SignorProtein("Q13887", "KLF5"),
+                                         mechanism="", effect="up-regulates", direct=True,
+                                         references=["333"], annotator=None)
+        lone_binding.mechanism.term = "GO:0005515"
+        for pc in [binding, kinase, lone_binding]:
+            pc_set.add(pc)
+
+        pc_set = pathway_connection_filter_protein_binding(pc_set)
+        self.assertEqual(pc_set.connections, [kinase, lone_binding])
+
+    def test_batch_conversion(self):
+        filenames = ["resources/test/SIGNOR-AC.tsv", "resources/test/does-not-exist.tsv"]
+        self.assertEqual(pathway_title(filenames[0]), "SIGNOR - Adipogenesis")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = convert_all(filenames, tmp_dir)
+            self.assertTrue(results[0].succeeded)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "SIGNOR-AC.ttl")))
+            self.assertFalse(results[1].succeeded)
+
+        filenames = ["resources/test/SIGNOR-AC.tsv", "resources/test/SIGNOR-LBC.tsv", "resources/test/SIGNOR-IL1R.tsv"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = convert_all(filenames, tmp_dir, jobs=2)
+            self.assertEqual([r.filename for r in results], filenames)
+            self.assertTrue(all(r.succeeded for r in results))
+            # Inputs unchanged since the last run so nothing gets regenerated, unless forced
+            os.remove(os.path.join(tmp_dir, "SIGNOR-LBC.ttl"))
+            results = convert_all(filenames, tmp_dir)
+            self.assertEqual([r.skipped for r in results], [True, False, True])
+            results = convert_all(filenames, tmp_dir, force=True)
+            self.assertFalse(any(r.skipped for r in results))
+
+        # Every module the converter runs and every metadata file is part of the fingerprint
+        for source in ["pathway_importer.py", "causal_graph.py", "triple_stream.py", "metrics.py"]:
+            self.assertIn(source, CONVERTER_SOURCES)
+        self.assertIn("metadata/signor_mechanism_rules.yaml", METADATA_FILES)
+
+    def test_dataset_output(self):
+        filenames = ["resources/test/SIGNOR-AC.tsv", "resources/test/does-not-exist.tsv", "resources/test/SIGNOR-IL1R.tsv"]
+        for jobs in [1, 2]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                dataset_file = os.path.join(tmp_dir, "signor.nq.gz")
+                results = convert_dataset(filenames, dataset_file, jobs=jobs)
+                self.assertEqual([r.succeeded for r in results], [True, False, True])
+                # Only the dataset is left behind, no part files
+                self.assertEqual(os.listdir(tmp_dir), ["signor.nq.gz"])
+                dataset = Dataset()
+                with gzip.open(dataset_file, "rt") as f:
+                    dataset.parse(data=f.read(), format="nquads")
+                # One named graph per model, holding the model's own title
+                titles = {}
+                for g in dataset.graphs():
+                    for title in g.objects(g.identifier, DC.title):
+                        titles[str(title)] = g.identifier
+                self.assertEqual(set(titles), {"SIGNOR - Adipogenesis", "SIGNOR - IL1 Receptor"})
+                for model_iri in titles.values():
+                    self.assertIsNotNone(dataset.graph(model_iri).value(model_iri, DC.date))
+
+    def test_synthetic_benchmark_pathway(self):
+        pathway_generator = SyntheticSignorPathway(seed=1, complex_ids=["SIGNOR-C1"])
+        rows = pathway_generator.rows(300)
+        self.assertEqual(len(rows), 300)
+        self.assertEqual(rows, SyntheticSignorPathway(seed=1, complex_ids=["SIGNOR-C1"]).rows(300))
+        self.assertNotEqual(rows, SyntheticSignorPathway(seed=2, complex_ids=["SIGNOR-C1"]).rows(300))
+        types = collections.Counter(row["TYPEA"] for row in rows)
+        self.assertGreater(types["protein"], types["smallmolecule"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            timings = []
+            for row_count in [100, 200]:
+                pathway_file = SyntheticSignorPathway(seed=1).write(os.path.join(tmp_dir, f"{row_count}.tsv"), row_count)
+                result = time_phases(pathway_file, os.path.join(tmp_dir, f"{row_count}.ttl"))
+                result["rows"] = row_count
+                self.assertGreater(result["connections"], 0)
+                self.assertGreater(result["triples"], 0)
+                self.assertTrue(os.path.exists(os.path.join(tmp_dir, f"{row_count}.ttl")))
+                timings.append(result)
+            scaling = scaling_exponents(timings)
+            self.assertEqual(len(scaling), 1)
+            self.assertIn("generate_model", scaling[0]["exponents"])
+
+    def test_whole_database_conversion(self):
+        pathway_files = ["resources/test/SIGNOR-AC.tsv", "resources/test/SIGNOR-IL1R.tsv"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Stand-in for the full export: every relation once, without the pathway columns
+            dump_file = os.path.join(tmp_dir, "all_data.tsv")
+            seen = set()
+            with open(dump_file, "w") as out:
+                for pathway_file in pathway_files:
+                    with open(pathway_file) as f:
+                        header = next(f).rstrip("\n").split("\t")
+                        if not seen:
+                            out.write("\t".join(header[2:]) + "\n")
+                        for line in f:
+                            row = line.rstrip("\n").split("\t")
+                            if row[-1] not in seen:
+                                seen.add(row[-1])
+                                out.write("\t".join(row[2:]) + "\n")
+
+            pathway_map = PathwayRelationMap.parse_files(pathway_files)
+            self.assertEqual(pathway_map.pathway_ids(), ["SIGNOR-AC", "SIGNOR-IL1R"])
+            results = convert_pathways_from_database(dump_file, pathway_map, tmp_dir)
+            self.assertTrue(all(r.succeeded for r in results))
+            for pathway_file, result in zip(pathway_files, results):
+                from_database = Graph()
+                from_database.parse(result.outfile, format="ttl")
+                model = generate_model(pathway_file, pathway_title(pathway_file))
+                # Same triples as converting the pathway download, up to the random individual IRIs
+                self.assertEqual(self.canonical_triples(from_database),
+                                 self.canonical_triples(model.writer.writer.graph))
+                self.assertEqual([str(t) for t in from_database.objects(None, DC.title)], [pathway_title(pathway_file)])
+
+            table = SignorRelationTable.parse_file(dump_file)
+            connections = list(table.connections.values())
+            # One model of everything takes the table's own connections rather than copies
+            p_connections = table.take_connection_set()
+            self.assertEqual(len(table), 0)
+            self.assertGreater(len(p_connections), 0)
+            self.assertLessEqual({id(pc) for pc in p_connections}, {id(pc) for pc in connections})
+
+            result = convert_whole_database(dump_file, os.path.join(tmp_dir, "all.nt"))
+            self.assertTrue(result.succeeded)
+            self.assertGreater(os.path.getsize(result.outfile), 0)
+
+        memory_budget = MemoryBudget(1)
+        with self.assertRaises(MemoryBudgetExceeded):
+            memory_budget.check("testing")
+        self.assertGreater(memory_budget.peak_mb, 1)
+
+    def test_complex_factory_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            complex_file = os.path.join(tmp_dir, "SIGNOR_complexes.csv")
+            with open(complex_file, "w") as cf:
+                cf.write("SIGNOR ID;COMPLEX NAME;LIST OF ENTITIES\n")
+                cf.write("SIGNOR-C3;mTORC1;P42345, Q8N122, Q9BVC4\n")
+            cache_dir = os.path.join(tmp_dir, "cache")
+            factory = SignorComplexFactory(complex_file, cache_dir=cache_dir)
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, "SIGNOR_complexes.csv.pickle")))
+            # A second load must come from the pickle, never from the CSV
+            with mock.patch.object(SignorComplexFactory, "parse", side_effect=AssertionError("CSV parsed again")):
+                cached_factory = SignorComplexFactory(complex_file, cache_dir=cache_dir)
+            self.assertEqual(cached_factory.complexes["SIGNOR-C3"].entities,
+                             factory.complexes["SIGNOR-C3"].entities)
+
+            with self.assertRaises(FileNotFoundError):
+                SignorComplexFactory(os.path.join(tmp_dir, "missing.csv"), offline=True)
+
+    def test_entities_are_interned(self):
+        p_connections = PathwayConnectionSet.parse_file("resources/test/SIGNOR-LBC.tsv")
+        entities_by_id = {}
+        for pc in p_connections.connections:
+            for entity in [pc.entity_a, pc.entity_b]:
+                self.assertIs(entities_by_id.setdefault((type(entity), entity.id, entity.name), entity), entity)
+        protein = SignorEntityFactory.determine_entity("P04637", "TP53", "protein")
+        self.assertIs(SignorEntityFactory.determine_entity("P04637", "TP53", "protein"), protein)
+        self.assertFalse(hasattr(protein, "__dict__"))
+
+    def test_concurrent_pathway_download(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubSignorHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        session = pooled_session(pool_size=2, retries=2, backoff_factor=0)
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                pathway_list = SignorDownloader.pathway_list(base_url=base_url, session=session)
+                self.assertEqual(pathway_list, set(StubSignorHandler.PATHWAYS))
+                results = SignorDownloader.download_pathways(pathway_list | {"SIGNOR-MISSING"}, tmp_dir,
+                                                             concurrency=2, base_url=base_url, session=session)
+                for pthwy_id in StubSignorHandler.PATHWAYS:
+                    with open(results[pthwy_id], "rb") as downloaded, \
+                            open(f"resources/test/{pthwy_id}.tsv", "rb") as original:
+                        self.assertEqual(downloaded.read(), original.read())
+                self.assertIsInstance(results["SIGNOR-MISSING"], Exception)
+                self.assertFalse(os.path.exists(os.path.join(tmp_dir, "SIGNOR-MISSING.tsv")))
+                complex_file, _ = SignorDownloader.download_reference_data(tmp_dir, base_url=base_url,
+                                                                           session=session)
+                self.assertIn("SIGNOR-C3", SignorComplexFactory(complex_file, cache_dir="").complexes)
+                self.assertEqual(sorted(os.listdir(tmp_dir)),
+                                 ["SIGNOR-AC.tsv", "SIGNOR-IL1R.tsv", "SIGNOR_PF.csv", "SIGNOR_complexes.csv"])
+
+            # Mirror manifest: second run only re-downloads what changed
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                manifest = MirrorManifest(tmp_dir)
+                SignorDownloader.download_pathways(pathway_list, tmp_dir, base_url=base_url, session=session,
+                                                   manifest=manifest)
+                manifest.save()
+                self.assertEqual(manifest.changed, {"SIGNOR-AC.tsv", "SIGNOR-IL1R.tsv"})
+                with open(os.path.join(tmp_dir, "SIGNOR-AC.tsv"), "a") as local_edit:
+                    local_edit.write("edited")
+                manifest = MirrorManifest(tmp_dir)
+                SignorDownloader.download_pathways(pathway_list, tmp_dir, base_url=base_url, session=session,
+                                                   manifest=manifest)
+                self.assertEqual(manifest.changed, {"SIGNOR-AC.tsv"})
+                self.assertEqual(manifest.unchanged, {"SIGNOR-IL1R.tsv"})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_pathway_connection_set_merges_references(self):
+        pc_set = PathwayConnectionSet()
+        for pmid in ["111", "222"]:
+            pc_set.add(PathwayConnection(SignorProtein("P49841", "GSK3B"), SignorProtein("P17676", "CEBPB"),
+                                         mechanism="phosphorylation", effect="up-regulates", direct=True,
+                                         references=[pmid], annotator=None))
+        other = PathwayConnection(SignorProtein("P49841", "GSK3B"), SignorProtein("P17676", "CEBPB"),
+                                  mechanism="binding", effect="up-regulates", direct=True,
+                                  references=["333"], annotator=None)
+        pc_set.add(other)
+        self.assertEqual(len(pc_set.connections), 2)
+        self.assertEqual(set(pc_set.connections[0].references), {"111", "222"})
+
+        self.assertEqual(len(pc_set.find_by_id_a("P49841")), 2)
+        self.assertEqual(len(pc_set.find_by_id_a_and_id_b("P49841", "P17676")), 2)
+
+        pc_set.remove_connection(other)
+        self.assertFalse(pc_set.contains(other))
+        self.assertEqual(len(pc_set.connections), 1)
+        self.assertEqual(len(pc_set.find_by_id_a("P49841")), 1)
+        self.assertEqual(len(pc_set.find_all_by_id_a_and_id_b(other).connections), 1)
+        self.assertEqual(pc_set.find_by_id_a("P17676"), [])
+
     def test_small_molecule_patterns(self):
         stmt_file = "resources/test/SIGNOR-smallmol.tsv"
         # CHEBI:16382 (iodide)-is_sm_mol_act->root MF->P07202 (TPO) (TC)
@@ -273,6 +649,183 @@ class TestSignor2Gocam(unittest.TestCase):
 
         # ProteinA-has_input->smallmolA and ProteinA-has_output->smallmolB should use same activity instance
 
+    def test_model_index_matches_graph(self):
+        model = generate_model("resources/test/SIGNOR-smallmol.tsv", "SIGNOR - Small molecule test")
+        self.assertIsInstance(model, SignorGoCamModel)
+        for class_curie, uris in model.individuals_by_class.items():
+            self.assertEqual(sorted(uris), sorted(GoCamModel.uri_list_for_individual(model, class_curie)))
+        self.assertGreater(len(model.axioms_by_statement), 0)
+        for statement, axiom in model.axioms_by_statement.items():
+            self.assertEqual(axiom, GoCamModel.find_bnode(model, statement))
+
+    def test_mechanism_rule_set(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rule_file = os.path.join(tmp_dir, "rules.yaml")
+            with open(rule_file, "w") as rf:
+                yaml.safe_dump({
+                    "RELATIONS": [
+                        {"EFFECT": "up-regulates", "DIRECT": True, "RELATION": "RO:0002629"},
+                        {"EFFECT": "up-regulates", "RELATION": "RO:0002213"},
+                    ],
+                    "INTERMEDIARY_PROCESSES": [
+                        {"MECHANISM": "GO:0004672", "ENTITY_A_TYPE": "protein", "PROCESS": "GO:0006468",
+                         "UPSTREAM_RELATION": "RO:0002213", "DOWNSTREAM_RELATION": "RO:0002213"},
+                    ],
+                }, rf)
+            rules = MechanismRuleSet(rule_file)
+        kinase = SignorProtein("P49841", "GSK3B")
+        pc = PathwayConnection(kinase, SignorProtein("P17676", "CEBPB"), "phosphorylation", "up-regulates activity",
+                               True, ["1"], None)
+        self.assertEqual(rules.relation(pc), OntologyTerm.DIRECTLY_POSITIVELY_REGULATES)
+        pc.direct = False
+        self.assertEqual(rules.relation(pc), OntologyTerm.POSITIVELY_REGULATES)
+        self.assertEqual(rules.intermediary_process(pc).process, "GO:0006468")
+        self.assertIn("GO:0006468", TERM_URIS)
+        pc.effect = "unknown"
+        self.assertIsNone(rules.relation(pc))
+        # Default rules
+        pc = PathwayConnection(SignorMicroRNA("MIMAT0000062", "miR-let7a"), kinase, "post transcriptional regulation",
+                               "down-regulates quantity", True, ["1"], None)
+        self.assertEqual(pc.relation, OntologyTerm.DIRECTLY_NEGATIVELY_REGULATES)
+        self.assertEqual(PathwayConnection.MECHANISM_RULES.intermediary_process(pc).process, "GO:0035195")
+
+    def test_relation_table(self):
+        rules = MechanismRuleSet("metadata/signor_mechanism_rules.yaml",
+                                 mechanism_terms=PathwayConnection.MECHANISM_GO_MAPPING.go_ids())
+        entity_a = SignorProtein("P49841", "GSK3B")
+        entity_b = SignorProtein("P17676", "CEBPB")
+        # Every known effect variant resolves straight from the precomputed table, same as going through the rules
+        for effect in ["up-regulates quantity by expression", "down-regulates activity", "unknown", ""]:
+            for mechanism in ["phosphorylation", ""]:
+                for direct in [True, False]:
+                    pc = PathwayConnection(entity_a, entity_b, mechanism, effect, direct, ["1"], None)
+                    self.assertIn((pc.mechanism.term, SignorProtein, effect, direct), rules._relation_table)
+                    self.assertEqual(rules.relation(pc), rules.lookup(rules._relations, pc).relation)
+        pc = PathwayConnection(entity_a, entity_b, "phosphorylation", "up-regulates quantity by expression", False,
+                               ["1"], None)
+        self.assertEqual(rules.relation(pc), OntologyTerm.POSITIVELY_REGULATES)
+        self.assertEqual(rules.unknown_effects, set())
+
+        # Effects SIGNOR isn't known to use are reported once and classified by prefix where possible
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            pc.effect = "up-regulates quantity by magic"
+            self.assertEqual(rules.relation(pc), OntologyTerm.POSITIVELY_REGULATES)
+            pc.effect = "sideways-regulates"
+            self.assertIsNone(rules.relation(pc))
+            self.assertIsNone(rules.relation(pc))
+        self.assertEqual(rules.unknown_effects, {"up-regulates quantity by magic", "sideways-regulates"})
+        self.assertEqual(stderr.getvalue().count("sideways-regulates"), 1)
+
+        # A pathway with an effect no rule can place still converts, just without regulation edges for it
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stmt_file = os.path.join(tmp_dir, "SIGNOR-AC-sideways.tsv")
+            with open("resources/test/SIGNOR-AC.tsv") as sf, open(stmt_file, "w") as out:
+                rows = list(csv.reader(sf, delimiter="\t"))
+                effect_column = [h.upper() for h in rows[0]].index("EFFECT")
+                for row in rows[1:]:
+                    row[effect_column] = "sideways-regulates"
+                csv.writer(out, delimiter="\t", lineterminator="\n").writerows(rows)
+            metrics = ConversionMetrics()
+            with contextlib.redirect_stderr(io.StringIO()):
+                model = generate_model(stmt_file, "SIGNOR - Adipogenesis", metrics=metrics)
+        self.assertGreater(metrics.counts["regulations_without_relation"], 0)
+        predicates = set(model.writer.writer.graph.predicates())
+        self.assertIn(ENABLED_BY, predicates)
+        self.assertIn(OntologyTerm.HAS_INPUT.uri, predicates)
+        self.assertFalse(predicates & {rule.relation.uri for rule in rules.relation_rules})
+
+    def test_term_uris_are_interned(self):
+        self.assertIs(OntologyTerm.POSITIVELY_REGULATES.uri, TERM_URIS["RO:0002213"])
+        self.assertEqual(str(OntologyTerm.HAS_INPUT.uri), "http://purl.obolibrary.org/obo/RO_0002233")
+        # Mechanism GO terms from the YAML mapping are in there too
+        self.assertIn(PathwayConnection.MECHANISM_GO_MAPPING.go_id_by_mechanism("phosphorylation"), TERM_URIS)
+
+        stmt_file = "resources/test/SIGNOR-AC.tsv"
+        model = generate_model(stmt_file, "SIGNOR - Adipogenesis")
+        statements = [pc.full_statement_bnode_in_model(model) for pc in PathwayConnectionSet.parse_file(stmt_file)]
+        self.assertTrue(any(statements))
+
+    def test_evidence_emitted_once_per_model(self):
+        model = generate_model("resources/test/SIGNOR-LBC.tsv", "SIGNOR - Luminal Breast Cancer")
+        query = """
+        SELECT DISTINCT ?evidence
+        WHERE { ?axiom <http://geneontology.org/lego/evidence> ?evidence . ?evidence rdf:type ECO:0000269 }
+        """
+        evidence_individuals = self.run_query(model, query)
+        self.assertEqual(len(evidence_individuals), len(model.evidence_ids))
+        # Statements with the same references and annotator share an evidence individual
+        query = "SELECT ?axiom ?evidence WHERE { ?axiom <http://geneontology.org/lego/evidence> ?evidence }"
+        self.assertGreater(len(self.run_query(model, query)), len(evidence_individuals))
+
+    def test_causal_graph(self):
+        graph = CausalGraph()
+        tp53 = SignorProtein("P04637", "TP53").add_to_graph(graph)
+        mdm2 = SignorProtein("Q00987", "MDM2").add_to_graph(graph)
+        ligase = graph.add_node("GO:0061630")
+        graph.add_edge(ligase, ENABLED_BY, mdm2)
+        graph.add_edge(ligase, OntologyTerm.HAS_INPUT.uri, tp53)
+        self.assertEqual((len(graph), graph.edge_count()), (3, 2))
+        self.assertEqual(graph.class_of(ligase), "GO:0061630")
+        model = SignorGoCamModel("CausalGraph test")
+        uris = graph.emit(model)
+        self.assertIn((uris[ligase], ENABLED_BY, uris[mdm2]), model.axioms_by_statement)
+        self.assertEqual(model.uri_list_for_individual("UniProtKB:P04637"), [uris[tp53]])
+
+    def test_streamed_triples_match_turtle(self):
+        stmt_file = "resources/test/SIGNOR-LBC.tsv"
+        model = generate_model(stmt_file, "SIGNOR - Luminal Breast Cancer")
+        ttl_graph = Graph()
+        ttl_graph.parse(data=model.writer.writer.graph.serialize(format="ttl"), format="ttl")
+
+        out = io.StringIO()
+        # Small batches so the model is written out in many pieces along the way
+        store = TripleStreamStore(out, batch_size=100)
+        generate_model(stmt_file, "SIGNOR - Luminal Breast Cancer", store=store)
+        store.close()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), len(set(lines)))
+        nt_graph = Graph()
+        nt_graph.parse(data=out.getvalue(), format="nt")
+        self.assertEqual(len(lines), len(ttl_graph))
+        self.assertEqual(self.canonical_triples(nt_graph), self.canonical_triples(ttl_graph))
+
+        self.assertEqual(output_format("models/SIGNOR-LBC.nq.gz"), "nq")
+        self.assertEqual(output_format("models/SIGNOR-LBC.ttl"), "ttl")
+
+    def test_conversion_metrics(self):
+        finished = []
+        metrics = ConversionMetrics(callback=lambda phase, seconds, m: finished.append(phase), trace_memory=True)
+        self.addCleanup(metrics.stop_tracing)
+        model = generate_model("resources/test/SIGNOR-LBC.tsv", "SIGNOR - Luminal Breast Cancer", metrics=metrics)
+        self.assertIs(model.metrics, metrics)
+        self.assertEqual(finished, ["parse", "filter", "declare_a_to_mechanism", "downstream_wiring", "emit_rdf"])
+        self.assertIn("intermediary_bp", metrics.seconds)
+        self.assertEqual(set(metrics.peak_memory), set(finished))
+        # Every individual and axiom in the model went through the counted methods
+        self.assertEqual(metrics.counts["declare_individual"], metrics.counts["causal_graph_nodes"])
+        # Repeated edges share one axiom, added once
+        self.assertEqual(metrics.counts["add_axiom"], len(model.axioms_by_statement))
+        self.assertLessEqual(metrics.counts["add_axiom"], metrics.counts["causal_graph_edges"])
+        self.assertEqual(metrics.counts["downstream_lookups"], metrics.counts["connections_converted"])
+        self.assertGreater(metrics.counts["graph_lookups"], 0)
+        self.assertIn("emit_rdf", metrics.report())
+        self.assertEqual(metrics.as_dict()["counts"]["add_axiom"], metrics.counts["add_axiom"])
+
+    def test_complex_declared_once_per_model(self):
+        # SIGNOR-C18 is entity A in 6 statements
+        stmt_file = "resources/test/SIGNOR-LBC.tsv"
+        query = "SELECT ?c ?label WHERE { ?c rdf:type GO:0032991 ; rdfs:label ?label }"
+        model = generate_model(stmt_file, "SIGNOR - Luminal Breast Cancer")
+        labels = [str(r["label"]) for r in self.run_query(model, query)]
+        self.assertEqual(len(labels), len(set(labels)))
+        self.assertGreater(len(labels), 0)
+
+        model = generate_model(stmt_file, "SIGNOR - Luminal Breast Cancer", complex_per_statement=True)
+        per_statement_labels = [str(r["label"]) for r in self.run_query(model, query)]
+        self.assertGreater(len(per_statement_labels), len(labels))
+        self.assertEqual(set(per_statement_labels), set(labels))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import gzip
+import os
+from rdflib.plugins.stores.memory import Memory
+from rdflib.term import Literal
+
+# Output formats that are written out while the model is generated instead of serialized from a full graph
+STREAM_FORMATS = ["nt", "nq"]
+
+
+def output_format(filename, default="ttl"):
+    # "ttl", "nt" or "nq" from the file extension, ignoring a trailing .gz
+    if filename.endswith(".gz"):
+        filename = filename[:-len(".gz")]
+    ext = os.path.splitext(filename)[1].lstrip(".")
+    if ext in ["ttl"] + STREAM_FORMATS:
+        return ext
+    return default
+
+
+def open_output(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", encoding="utf-8")
+    return open(filename, "w", encoding="utf-8")
+
+
+@contextlib.contextmanager
+def open_triple_stream(filename):
+    # TripleStreamStore writing to filename: N-Quads for .nq(.gz), N-Triples otherwise. The last batch is written
+    # out on the way out.
+    with open_output(filename) as out:
+        with contextlib.closing(TripleStreamStore(out, quads=(output_format(filename) == "nq"))) as store:
+            yield store
+
+
+def nt_term(term):
+    # N-Triples form of a term. Literal.n3() would write multi-line strings Turtle-style with triple quotes.
+    if isinstance(term, Literal):
+        value = str(term).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+        if term.language:
+            return f'"{value}"@{term.language}'
+        if term.datatype:
+            return f'"{value}"^^{term.datatype.n3()}'
+        return f'"{value}"'
+    return term.n3()
+
+
+class TripleStreamStore(Memory):
+    # rdflib store for GoCamModel(store=...) that writes triples to out as N-Triples (or N-Quads, named by the
+    # model's graph). Triples are held like in any Memory store until batch_size of them have been added, then
+    # written out and dropped, so memory stays flat however big the model gets. Lookups and removals only see
+    # the batch that hasn't been written yet. Nothing keeps track of what was already written: the model has to
+    # add each triple once, which SignorGoCamModel and CausalGraph.emit do. close() writes the last batch.
+    def __init__(self, out, quads=False, batch_size=10000):
+        Memory.__init__(self)
+        self.out = out
+        self.quads = quads
+        self.batch_size = batch_size
+
+    def add(self, triple, context, quoted=False):
+        Memory.add(self, triple, context, quoted=quoted)
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for triple, contexts in self.triples((None, None, None)):
+            row = " ".join(nt_term(term) for term in triple)
+            if self.quads:
+                for context in contexts:
+                    self.out.write(f"{row} {nt_term(context.identifier)} .\n")
+            else:
+                self.out.write(f"{row} .\n")
+        self.remove((None, None, None))
+
+    def close(self, commit_pending_transaction=False):
+        self.flush()
@@ -1,4 +1,6 @@
 from enum import Enum
+from prefixcommons.curie_util import expand_uri
+from rdflib.term import URIRef
 
 
 class OntologyTerm(Enum):
@@ -12,3 +14,41 @@ class OntologyTerm(Enum):
     CAUSALLY_UPSTREAM_OF_NEGATIVE_EFFECT = "RO:0002305"
     HAS_INPUT = "RO:0002233"
     HAS_OUTPUT = "RO:0002234"
+
+    @property
+    def uri(self):
+        return TERM_URIS[self.value]
+
+
+class TermUriTable:
+    # CURIE -> URIRef for the fixed vocabulary (relations, mechanism GO terms, intermediary BPs). Each CURIE is
+    # expanded once and the same URIRef object is shared everywhere after that.
+    def __init__(self, curies=()):
+        self._uris = {}
+        self.add_all(curies)
+
+    def add(self, curie):
+        uri = self._uris.get(curie)
+        if uri is None:
+            uri = URIRef(expand_uri(curie))
+            self._uris[curie] = uri
+        return uri
+
+    def add_all(self, curies):
+        for curie in curies:
+            self.add(curie)
+
+    def get(self, curie, default=None):
+        return self._uris.get(curie, default)
+
+    def __getitem__(self, curie):
+        return self._uris[curie]
+
+    def __contains__(self, curie):
+        return curie in self._uris
+
+    def __len__(self):
+        return len(self._uris)
+
+
+TERM_URIS = TermUriTable(term.value for term in OntologyTerm)
@@ -0,0 +1,241 @@
+import argparse
+import gc
+import os
+import resource
+import sys
+import traceback
+from typing import Dict, List
+from entity_factories import SignorEntityFactory
+from generate_all_models import ConversionResult, print_summary
+from pathway_connections import PathwayConnection, PathwayConnectionSet, open_pathway_file, read_rows, \
+    acceptable_column_rows
+from pathway_importer import pathway_connection_filter_protein_binding, model_from_connections
+from triple_stream import STREAM_FORMATS, open_triple_stream, output_format
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', "--filename", type=str, required=True,
+                    help="Full SIGNOR relation export (all pathways). Can be gzipped. Use '-' to read from stdin")
+parser.add_argument('-o', "--outfile", type=str,
+                    help="Write one model of every relation in the export to this file. Use .nt or .nq (optionally "
+                         ".gz) to stream it out instead of holding the whole graph for Turtle")
+parser.add_argument('-t', "--model_title", nargs='+',
+                    help="Title of the --outfile model. Defaults to 'SIGNOR - all relations'")
+parser.add_argument("--outdir", type=str,
+                    help="Write one model per pathway in --pathway_map to this directory instead")
+parser.add_argument("--pathway_map", type=str, nargs='+',
+                    help="TSV(s) with PATHWAY_ID, PATHWAY_NAME and SIGNOR_ID columns saying which relations make up "
+                         "each pathway, e.g. the per-pathway downloads themselves")
+parser.add_argument("--format", type=str, default="ttl", choices=["ttl"] + STREAM_FORMATS,
+                    help="Format of the per-pathway models in --outdir. Defaults to ttl")
+parser.add_argument("--tax_id", type=str,
+                    help="Only convert relations of this organism, e.g. 9606")
+parser.add_argument("--memory_budget_mb", type=int,
+                    help="Stop with an error if the process grows past this many MiB")
+parser.add_argument("--offline", action="store_true",
+                    help="Fail instead of downloading missing SIGNOR complex data")
+
+
+class PathwayRelationMap:
+    # Which relations (SIGNOR_ID) make up each pathway, in the order they're listed. Pathways keep the order they're
+    # first seen in.
+    def __init__(self):
+        self.pathway_names: Dict[str, str] = {}
+        self.relation_ids: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def parse_files(filenames):
+        pathway_map = PathwayRelationMap()
+        for filename in filenames:
+            with open_pathway_file(filename) as f:
+                for row in read_rows(f):
+                    pathway_id = row["PATHWAY_ID"]
+                    if pathway_id not in pathway_map.pathway_names:
+                        pathway_map.pathway_names[pathway_id] = row["PATHWAY_NAME"] or pathway_id
+                        pathway_map.relation_ids[pathway_id] = []
+                    pathway_map.relation_ids[pathway_id].append(row["SIGNOR_ID"])
+        return pathway_map
+
+    def pathway_ids(self):
+        return list(self.pathway_names)
+
+    def all_relation_ids(self):
+        relation_ids = set()
+        for ids in self.relation_ids.values():
+            relation_ids.update(ids)
+        return relation_ids
+
+    def __len__(self):
+        return len(self.pathway_names)
+
+
+class SignorRelationTable:
+    # Every convertible relation of the full export parsed once into a PathwayConnection, indexed by SIGNOR_ID.
+    # Entities, mechanisms and relations are resolved here a single time; pathways are then put together from
+    # clones of these connections rather than by parsing their rows again. Only the parsing is shared: each
+    # pathway's connection set still builds its own indexes, runs the protein binding filter and wires its own
+    # CausalGraph, since all of those depend on which relations are in the pathway.
+    def __init__(self):
+        self.connections: Dict[str, PathwayConnection] = {}
+        self.total_rows = 0
+
+    @staticmethod
+    def parse_file(filename, tax_id=None, relation_ids=None):
+        # relation_ids: only keep these relations, e.g. the ones some pathway actually uses
+        table = SignorRelationTable()
+        counts = {"total": 0, "converted": 0}
+        column_filters = {}
+        if tax_id is not None:
+            column_filters["TAX_ID"] = [tax_id]
+        if relation_ids is not None:
+            column_filters["SIGNOR_ID"] = relation_ids
+        with open_pathway_file(filename) as f:
+            for linenum, row, direct in acceptable_column_rows(f, counts=counts, column_filters=column_filters):
+                table.connections[row["SIGNOR_ID"]] = PathwayConnection.parse_line(row, linenum=linenum,
+                                                                                   direct=direct)
+        table.total_rows = counts["total"]
+        print("Total statement count:", counts["total"])
+        print("Converted statement count", counts["converted"])
+        return table
+
+    def connection_set(self, relation_ids):
+        # PathwayConnectionSet of the given relations. Connections are cloned so that merging references within one
+        # set doesn't leak into another.
+        pc_set = PathwayConnectionSet()
+        for relation_id in relation_ids:
+            pc = self.connections.get(relation_id)
+            if pc is not None:
+                pc_set.add(pc.clone())
+        return pc_set
+
+    def take_connection_set(self):
+        # PathwayConnectionSet of every relation, for when only one model is built from the table. The connections
+        # are handed over to the set instead of cloned and the table is left empty, so they're only held once.
+        pc_set = PathwayConnectionSet()
+        connections, self.connections = self.connections, {}
+        for pc in connections.values():
+            pc_set.add(pc)
+        return pc_set
+
+    def __len__(self):
+        return len(self.connections)
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+def current_memory_mb():
+    # Resident set size. Where /proc isn't around, fall back to the peak, which can only overestimate.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return peak / (1024 * 1024)  # bytes on macOS, KiB elsewhere
+        return peak / 1024
+
+
+class MemoryBudget:
+    # Checked after each step of the run. Only one model is held at a time, so going over means a single step
+    # (the relation table or one model) doesn't fit.
+    def __init__(self, budget_mb=None):
+        self.budget_mb = budget_mb
+        self.peak_mb = 0.0
+
+    def check(self, step):
+        used_mb = current_memory_mb()
+        if self.budget_mb is not None and used_mb > self.budget_mb:
+            gc.collect()
+            used_mb = current_memory_mb()
+        self.peak_mb = max(self.peak_mb, used_mb)
+        if self.budget_mb is not None and used_mb > self.budget_mb:
+            raise MemoryBudgetExceeded(f"Using {used_mb:.0f} MiB after {step}, over the budget of "
+                                       f"{self.budget_mb} MiB")
+
+
+def write_model(p_connections, title, outfile):
+    p_connections = pathway_connection_filter_protein_binding(p_connections)
+    if output_format(outfile) in STREAM_FORMATS:
+        with open_triple_stream(outfile) as store:
+            model_from_connections(p_connections, title, store=store)
+    else:
+        model = model_from_connections(p_connections, title)
+        model.write(outfile)
+
+
+def convert_whole_database(filename, outfile, title="SIGNOR - all relations", tax_id=None, memory_budget=None):
+    # One model of every relation in the export
+    if memory_budget is None:
+        memory_budget = MemoryBudget()
+    SignorEntityFactory.complex_factory()
+    table = SignorRelationTable.parse_file(filename, tax_id=tax_id)
+    memory_budget.check("parsing the relation export")
+    p_connections = table.take_connection_set()
+    del table
+    try:
+        write_model(p_connections, title, outfile)
+    except Exception:
+        return ConversionResult(filename, outfile, error=traceback.format_exc())
+    memory_budget.check("writing the model")
+    return ConversionResult(filename, outfile)
+
+
+def convert_pathways_from_database(filename, pathway_map, outdir, out_format="ttl", tax_id=None,
+                                   memory_budget=None) -> List[ConversionResult]:
+    # One model per pathway in pathway_map, all built from a single pass over the export. Everything after the
+    # parse (indexes, filtering, wiring) is still done per pathway. Each model is written and dropped before the
+    # next one is started.
+    if memory_budget is None:
+        memory_budget = MemoryBudget()
+    os.makedirs(outdir, exist_ok=True)
+    SignorEntityFactory.complex_factory()
+    table = SignorRelationTable.parse_file(filename, tax_id=tax_id, relation_ids=pathway_map.all_relation_ids())
+    memory_budget.check("parsing the relation export")
+    results = []
+    for pathway_id in pathway_map.pathway_ids():
+        outfile = os.path.join(outdir, f"{pathway_id}.{out_format}")
+        print("Converting", pathway_id)
+        try:
+            p_connections = table.connection_set(pathway_map.relation_ids[pathway_id])
+            write_model(p_connections, f"SIGNOR - {pathway_map.pathway_names[pathway_id]}", outfile)
+            results.append(ConversionResult(pathway_id, outfile))
+        except Exception:
+            results.append(ConversionResult(pathway_id, outfile, error=traceback.format_exc()))
+        memory_budget.check(f"converting {pathway_id}")
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    if bool(args.outfile) == bool(args.outdir):
+        parser.error("give either --outfile for one model or --outdir for per-pathway models")
+    if args.outdir and not args.pathway_map:
+        parser.error("--outdir needs --pathway_map to know which relations go in each pathway")
+
+    if args.offline:
+        SignorEntityFactory.offline = True
+    memory_budget = MemoryBudget(args.memory_budget_mb)
+    try:
+        if args.outfile:
+            title = "SIGNOR - all relations"
+            if args.model_title:
+                title = " ".join(args.model_title)
+            results = [convert_whole_database(args.filename, args.outfile, title=title, tax_id=args.tax_id,
+                                              memory_budget=memory_budget)]
+        else:
+            pathway_map = PathwayRelationMap.parse_files(args.pathway_map)
+            print(len(pathway_map), "pathways in the pathway map")
+            results = convert_pathways_from_database(args.filename, pathway_map, args.outdir, out_format=args.format,
+                                                     tax_id=args.tax_id, memory_budget=memory_budget)
+    except MemoryBudgetExceeded as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    print_summary(results)
+    print(f"Peak memory {memory_budget.peak_mb:.0f} MiB")
+    if not all(r.succeeded for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()